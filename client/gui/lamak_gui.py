@@ -1,4 +1,5 @@
 import base64
+import io
 import json
 import os
 import threading
@@ -10,11 +11,14 @@ import pyautogui
 import requests
 from dotenv import load_dotenv
 
-from gui.utils import shared_state
+from gui.utils import shared_state, start_request
 from gui.ws_client import sio
 
 load_dotenv()
 
+# 2 sends the snip as a binary attachment, 1 falls back to base64 json
+PROTOCOL_VERSION = int(os.environ.get("MRG_PROTOCOL", 2))
+
 
 class Application:
     def __init__(self, master):
@@ -63,11 +67,25 @@ class Application:
         self.poll_thread.start()
 
     def poll_mrg_readiness(self):
+        shown = ""
         while not self.stop_thread_flag:
             time.sleep(1)  # Poll every second
             if shared_state["mrg_ready"]:
-                self.text_area.insert(END, shared_state["report"])
-                break
+                text = shared_state["report"]
+            else:
+                # the grading and the report so far while the server works
+                text = "\n".join(
+                    part
+                    for part in (
+                        shared_state["partial_report"],
+                        shared_state["grading"],
+                    )
+                    if part
+                )
+            if text != shown:
+                self.text_area.delete("1.0", END)
+                self.text_area.insert(END, text)
+                shown = text
 
     def create_screen_canvas(self):
         self.master_screen.deiconify()
@@ -89,32 +107,42 @@ class Application:
         image = pyautogui.screenshot(region=(int(x1), int(y1), int(x2), int(y2)))
         random_uuid = str(uuid.uuid4())
         img_file_path = f"{self.assets_dir}/{random_uuid}.png"
-        image.save(img_file_path)
-
-        # base64 encode image
-        with open(img_file_path, "rb") as img:
-            # Read the audio file as bytes
-            audio_data = img.read()
-
-            # Encode the audio data in base64
-            encoded_img = base64.b64encode(audio_data).decode("utf-8")
 
-            data = {
+        # encode the png once, in memory, and keep a local copy of the bytes
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        img_data = buffer.getvalue()
+        with open(img_file_path, "wb") as img:
+            img.write(img_data)
+        start_request(random_uuid)
+
+        if PROTOCOL_VERSION >= 2:
+            # metadata header + raw png sent as a binary socket.io attachment
+            meta = {
                 "unique_uuid": random_uuid,
-                "encoded_img": encoded_img
+                "format": "png",
+                "width": image.width,
+                "height": image.height,
             }
+            sio.emit("mrg_v2", (meta, img_data))
+            return
+
+        # legacy protocol, base64 encode image into the json payload
+        encoded_img = base64.b64encode(img_data).decode("utf-8")
+
+        data = {"unique_uuid": random_uuid, "encoded_img": encoded_img}
 
-            # headers = {"Content-Type": "application/json"}
-            # data = json.dumps(data)
-            #
-            # res = requests.post(url=os.environ["SERVER_IP"], data=data, headers=headers)
-            # res = json.loads(res.text)
-            # report = res["mrg_result"]
+        # headers = {"Content-Type": "application/json"}
+        # data = json.dumps(data)
+        #
+        # res = requests.post(url=os.environ["SERVER_IP"], data=data, headers=headers)
+        # res = json.loads(res.text)
+        # report = res["mrg_result"]
 
-            sio.emit("mrg", data)
+        sio.emit("mrg", data)
 
-            # paste response to box
-            # self.text_area.insert(END, report)
+        # paste response to box
+        # self.text_area.insert(END, report)
 
     def on_button_release(self, event):
         if self.start_x <= self.current_x and self.start_y <= self.current_y:
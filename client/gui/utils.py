@@ -1,4 +1,31 @@
+import threading
+
 shared_state = {
+    # the snip whose results are shown, events for any other one are stale
+    "unique_uuid": None,
     "mrg_ready": False,
-    "report": ""
-}
\ No newline at end of file
+    "report": "",
+    # filled in progressively while the server is still working
+    "grading": "",
+    "partial_report": "",
+}
+_lock = threading.Lock()
+
+
+def start_request(unique_uuid):
+    # a new snip: nothing of the previous one may show up under it
+    with _lock:
+        shared_state.update(
+            unique_uuid=unique_uuid,
+            mrg_ready=False,
+            report="",
+            grading="",
+            partial_report="",
+        )
+
+
+def update_request(unique_uuid, **fields):
+    # results of an earlier snip that arrive late are dropped
+    with _lock:
+        if unique_uuid == shared_state["unique_uuid"]:
+            shared_state.update(fields)
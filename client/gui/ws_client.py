@@ -4,7 +4,7 @@ import time
 
 import socketio
 
-from gui.utils import shared_state
+from gui.utils import shared_state, update_request
 
 sio = socketio.Client(reconnection=True, reconnection_delay=5)
 LAST_HEARTBEAT = time.time()
@@ -19,10 +19,41 @@ def connect():
 def connected(data):
     print(f"connected {data['data']}")
 
+
 @sio.on("mrg_result")
 def send_brain_image(data):
     print("received video_data")
 
-    # Decode the Base64 encoded video data
-    shared_state["mrg_ready"] = True
-    shared_state["report"] = data['mrg_result']
+    update_request(data["unique_uuid"], mrg_ready=True, report=data["mrg_result"])
+
+
+@sio.on("mrg_grading")
+def receive_grading(data):
+    # the classifier grading arrives before the generated report
+    update_request(data["unique_uuid"], grading=data["grading"])
+
+
+@sio.on("mrg_partial")
+def receive_partial_report(data):
+    update_request(data["unique_uuid"], partial_report=data["partial_report"])
+
+
+@sio.on("mrg_busy")
+def receive_busy(data):
+    # the server's queue (or this client's share of it) is full
+    update_request(
+        data["unique_uuid"],
+        mrg_ready=True,
+        report=f"server busy ({data['reason']}), please try again",
+    )
+
+
+@sio.on("mrg_error")
+def receive_error(data):
+    # e.g. an image the server could not decode, no report will follow. A
+    # payload too broken to carry its unique_uuid can only be the current one
+    update_request(
+        data["unique_uuid"] or shared_state["unique_uuid"],
+        mrg_ready=True,
+        report=f"could not generate a report: {data['error']}",
+    )
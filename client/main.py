@@ -9,7 +9,8 @@ from gui.ws_client import sio
 
 if __name__ == "__main__":
     try:
-        sio.connect(os.environ["URL"])
+        # websocket only: a session never has to hop between server workers
+        sio.connect(os.environ["URL"], transports=["websocket"])
 
         root = Tk()
         app = Application(root)
@@ -0,0 +1,86 @@
+import argparse
+import time
+
+import torch
+from easydict import EasyDict as edict
+from torch.utils.flop_counter import FlopCounterMode
+
+from bench.common import add_image_args, read_imgs, synthetic_imgs
+from diagnosis_module.cxr.diagnosis import (
+    cxr_infer,
+    cxr_init,
+    get_cxr_imgs,
+)
+from diagnosis_module.cxr.utils import aspect_buckets
+from r2g.mrg_main import MRG
+
+
+def parse_buckets(value):
+    return [
+        [int(side) for side in size.split("x")] for size in value.split(",") if size
+    ]
+
+
+def classify(img_model, img_cfg, img):
+    # probabilities, FLOPs and seconds of one image through the classifier
+    _, img2 = get_cxr_imgs([img], img_cfg)
+    if isinstance(img2, list):
+        img2 = img2[0][1]
+    counter = FlopCounterMode(display=False)
+    with torch.no_grad(), counter:
+        cxr_infer(img_model, img2, img_cfg)
+    start = time.perf_counter()
+    probs = cxr_infer(img_model, img2, img_cfg)[0]
+    seconds = time.perf_counter() - start
+    return probs, counter.get_total_flops(), seconds, tuple(img2.shape[-2:])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="classifier FLOPs saved and score drift of aspect buckets"
+    )
+    add_image_args(parser, batch_size=None)
+    parser.add_argument(
+        "--buckets", default="512x384,384x512", help="height x width, comma separated"
+    )
+    args = parser.parse_args()
+
+    imgs = read_imgs(args.images)
+    if not imgs:
+        # portrait, landscape and near-square screenshots and exports
+        sizes = ((2048, 1700), (1500, 2000), (1024, 1024), (900, 1600), (2000, 1400))
+        imgs = [synthetic_imgs(1, size, "L")[0] for size in sizes]
+
+    img_model, img_cfg = cxr_init(MRG.img_cfg_path, MRG.img_weight_path)
+    img_model.eval()
+    bucket_cfg = edict(img_cfg)
+    bucket_cfg.aspect_buckets = parse_buckets(args.buckets)
+    print(f"buckets: {aspect_buckets(bucket_cfg)}")
+
+    totals = [0, 0, 0.0, 0.0]
+    drifts = []
+    for index, img in enumerate(imgs):
+        square = classify(img_model, img_cfg, img)
+        bucket = classify(img_model, bucket_cfg, img)
+        drift = (square[0] - bucket[0]).abs().max().item()
+        drifts.append(drift)
+        for i, value in enumerate((square[1], bucket[1], square[2], bucket[2])):
+            totals[i] += value
+        w, h = img.size
+        print(
+            f"{index}: {h}x{w} -> {bucket[3][0]}x{bucket[3][1]}  "
+            f"{bucket[1] / 1e9:.2f} vs {square[1] / 1e9:.2f} GFLOPs  "
+            f"{bucket[2] * 1000:.0f} vs {square[2] * 1000:.0f} ms  "
+            f"max score drift {drift:.4f}"
+        )
+
+    square_flops, bucket_flops, square_seconds, bucket_seconds = totals
+    print(
+        f"FLOPs saved {1 - bucket_flops / square_flops:.1%}, "
+        f"latency saved {1 - bucket_seconds / square_seconds:.1%}, "
+        f"score drift mean {sum(drifts) / len(drifts):.4f} max {max(drifts):.4f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import io
+import sys
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+from diagnosis_module.cxr.diagnosis import decode_cxr_img
+
+
+def encode(array, mode):
+    buf = io.BytesIO()
+    Image.fromarray(array, mode=mode).save(buf, format="png")
+    return buf.getvalue()
+
+
+def synthetic_imgs(count, size, mode):
+    rng = np.random.default_rng(0)
+    h, w = size
+    shape = (h, w) if mode == "L" else (h, w, 3)
+    return [
+        decode_cxr_img(encode(rng.integers(0, 256, shape, dtype=np.uint8), mode=mode))
+        for _ in range(count)
+    ]
+
+
+def add_image_args(parser, batch_size=4):
+    # batch_size None leaves out --batch-size, for scripts with their own mix
+    parser.add_argument("images", nargs="*", help="image files, default synthetic")
+    if batch_size is not None:
+        parser.add_argument("--batch-size", type=int, default=batch_size)
+
+
+def read_imgs(paths):
+    return [decode_cxr_img(open(path, "rb").read()) for path in paths]
+
+
+def load_imgs(args, size=(1024, 850), mode="L"):
+    # the image files given on the command line, else a synthetic batch
+    if args.images:
+        return read_imgs(args.images)
+    return synthetic_imgs(args.batch_size, size, mode)
+
+
+def clone_inputs(img1, img2):
+    # copied out of the reusable preprocessing buffers; with aspect buckets
+    # the classifier input is a list of (indices, tensor) groups
+    if isinstance(img2, list):
+        return img1.clone(), [(indices, tensor.clone()) for indices, tensor in img2]
+    return img1.clone(), img2.clone()
+
+
+def per_group(fn, img2):
+    # fn over a classifier batch, or over each aspect bucket's group with the
+    # rows put back in image order
+    if not isinstance(img2, list):
+        return fn(img2)
+    rows = {}
+    for indices, batch in img2:
+        rows.update(zip(indices, fn(batch)))
+    return torch.stack([rows[index] for index in range(len(rows))])
+
+
+def timed(fn, *args):
+    # result and seconds of the second call, the first one warms up
+    fn(*args)
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def relative_error(expected, actual):
+    # max abs difference relative to the output scale
+    error = (expected - actual).abs().max() / expected.abs().max().clamp(min=1e-12)
+    return error.item()
+
+
+def finish(failed):
+    # exit status for scripts and CI: 1 if any named check failed
+    if failed:
+        print("FAILED: " + ", ".join(failed))
+        sys.exit(1)
+    print("ok")
@@ -0,0 +1,82 @@
+import argparse
+
+import torch
+
+from bench.common import (
+    add_image_args,
+    clone_inputs,
+    finish,
+    load_imgs,
+    per_group,
+    relative_error,
+    timed,
+)
+from diagnosis_module.cxr.diagnosis import cxr_init, get_cxr_imgs
+from diagnosis_module.cxr.preprocess import REPORT_MEAN, REPORT_STD
+from optimize.fold_bn import fold_bn_classifier, fold_bn_visual_extractor
+from optimize.single_channel import (
+    single_channel_classifier,
+    single_channel_visual_extractor,
+)
+from r2g.mrg_main import MRG
+from r2g.report_generate import report_gen_cfg
+
+
+def run(img_model, visual_extractor, img1, img2):
+    with torch.no_grad():
+        logits, classifier_seconds = timed(per_group, img_model.predict, img2)
+        (patch_feats, avg_feats), report_seconds = timed(visual_extractor, img1)
+    return (logits, patch_feats, avg_feats), (classifier_seconds, report_seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="parity of the BatchNorm-folded models with the loaded ones"
+    )
+    add_image_args(parser)
+    parser.add_argument("--rtol", type=float, default=1e-4)
+    parser.add_argument(
+        "--single-channel", action="store_true", help="fold the grey stems first"
+    )
+    args = parser.parse_args()
+
+    imgs = load_imgs(args)
+
+    img_model, img_cfg = cxr_init(MRG.img_cfg_path, MRG.img_weight_path)
+    img_model.eval()
+    visual_extractor = report_gen_cfg().model.visual_extractor.eval()
+    channels = 3
+    if args.single_channel:
+        single_channel_classifier(img_model)
+        single_channel_visual_extractor(visual_extractor, REPORT_MEAN, REPORT_STD)
+        channels = 1
+    img1, img2 = clone_inputs(*get_cxr_imgs(imgs, img_cfg, channels=channels))
+
+    expected, loaded_seconds = run(img_model, visual_extractor, img1, img2)
+    for name, counts in (
+        ("classifier", fold_bn_classifier(img_model)),
+        ("visual_extractor", fold_bn_visual_extractor(visual_extractor)),
+    ):
+        print(f"{name:>16}: {counts[0]} norms folded, {counts[1]} scale-shift")
+    actual, folded_seconds = run(img_model, visual_extractor, img1, img2)
+
+    for name, loaded, folded in zip(
+        ("classifier", "visual_extractor"), loaded_seconds, folded_seconds
+    ):
+        print(
+            f"{name:>16}: loaded {loaded * 1000:.1f} ms, folded {folded * 1000:.1f} ms"
+        )
+
+    failed = []
+    for name, a, b in zip(("logits", "patch_feats", "avg_feats"), expected, actual):
+        # relative to the output scale, folding only reorders the arithmetic
+        error = relative_error(a, b)
+        print(f"{name:>16}: max relative diff {error:.3g}")
+        if error > args.rtol:
+            failed.append(name)
+
+    finish(failed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import argparse
+import time
+
+import torch
+from easydict import EasyDict as edict
+
+from bench.common import finish
+from diagnosis_module.cxr.diagnosis import cxr_init
+from diagnosis_module.cxr.models.classifier import Classifier
+from r2g.mrg_main import MRG
+
+
+def compare(model, x):
+    # the per-class loop of forward() against the fused predict()
+    with torch.no_grad():
+        start = time.perf_counter()
+        expected = torch.cat(model(x)[0], dim=1)
+        loop_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        actual = model.predict(x)
+        fused_seconds = time.perf_counter() - start
+    error = (expected - actual).abs().max().item()
+    return error, loop_seconds, fused_seconds
+
+
+def variants(img_cfg):
+    # randomly initialised heads for the other pooling / attention branches
+    for global_pool in ("AVG_MAX", "AVG_MAX_LSE", "AVG", "PCAM"):
+        for attention_map in ("FPA", "None"):
+            for fc_bn in (True, False):
+                cfg = edict(img_cfg)
+                cfg.global_pool = global_pool
+                cfg.attention_map = attention_map
+                cfg.fc_bn = fc_bn
+                model = Classifier(cfg).eval()
+                for index in range(len(cfg.num_classes)):
+                    bn = getattr(model, "bn_" + str(index))
+                    bn.running_mean.uniform_(-1, 1)
+                    bn.running_var.uniform_(0.5, 2)
+                yield f"{global_pool}/{attention_map}/fc_bn={fc_bn}", model
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="parity of Classifier.predict with the per-class forward loop"
+    )
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--atol", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    img_model, img_cfg = cxr_init(MRG.img_cfg_path, MRG.img_weight_path)
+    img_model.eval()
+    img_model.cache_heads()
+    x = torch.randn(args.batch_size, 3, img_cfg.long_side, img_cfg.long_side)
+
+    failed = []
+    error, loop_seconds, fused_seconds = compare(img_model, x)
+    print(
+        f"checkpoint: max abs diff {error:.3g}, forward {loop_seconds * 1000:.0f} ms, "
+        f"predict {fused_seconds * 1000:.0f} ms"
+    )
+    if error > args.atol:
+        failed.append("checkpoint")
+
+    small = torch.randn(2, 3, 256, 256)
+    for name, model in variants(img_cfg):
+        error, _, _ = compare(model, small)
+        print(f"{name:>32}: max abs diff {error:.3g}")
+        if error > args.atol:
+            failed.append(name)
+
+    finish(failed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import argparse
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+
+def profile_imports(module):
+    """
+    Imports `module` in a fresh interpreter under `-X importtime` and returns
+    one (module, self_us, cumulative_us, depth) tuple per imported module.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+
+    records = []
+    for line in proc.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            # nested imports are indented by two spaces per level
+            depth = (len(indent) - 1) // 2
+            records.append((name, int(self_us), int(cumulative_us), depth))
+    return records
+
+
+def report(records, top=25):
+    total_us = sum(cumulative for _, _, cumulative, depth in records if depth == 0)
+    by_package = defaultdict(int)
+    for name, self_us, _, _ in records:
+        by_package[name.split(".")[0]] += self_us
+
+    lines = [f"total import time: {total_us / 1000:.1f} ms ({len(records)} modules)"]
+    lines.append("")
+    lines.append(f"top {top} packages by self time:")
+    for package, self_us in sorted(by_package.items(), key=lambda kv: -kv[1])[:top]:
+        lines.append(f"{self_us / 1000:10.1f} ms  {package}")
+    lines.append("")
+    lines.append(f"top {top} modules by cumulative time:")
+    for name, self_us, cumulative_us, depth in sorted(records, key=lambda r: -r[2])[
+        :top
+    ]:
+        lines.append(
+            f"{cumulative_us / 1000:10.1f} ms  {self_us / 1000:8.1f} ms self  "
+            f"{'  ' * depth}{name}"
+        )
+    return total_us, "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="import time breakdown of a server module (python -X importtime)"
+    )
+    parser.add_argument(
+        "module",
+        nargs="?",
+        default="wsgi",
+        help="module to import; wsgi also builds the models, which shows up as "
+        "its own self time",
+    )
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        help="exit with status 1 when the total import time exceeds this",
+    )
+    args = parser.parse_args()
+
+    total_us, text = report(profile_imports(args.module), args.top)
+    print(text)
+    if args.budget_ms is not None and total_us / 1000 > args.budget_ms:
+        print(
+            f"\nimport time {total_us / 1000:.1f} ms exceeds budget {args.budget_ms} ms"
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
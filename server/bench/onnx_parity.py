@@ -0,0 +1,105 @@
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import torch
+
+from bench.common import finish, relative_error
+from diagnosis_module.cxr.diagnosis import cxr_init
+from model_io.onnx_export import export_classifier, export_visual_extractor
+from model_io.onnx_runtime import OrtClassifier, OrtModule
+from optimize.fold_bn import fold_bn_classifier, fold_bn_visual_extractor
+from r2g.mrg_main import MRG
+from r2g.report_generate import report_gen_cfg
+
+
+def latency(fn, x, repeat):
+    # median milliseconds after one untimed call
+    fn(x)
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(x)
+        seconds.append(time.perf_counter() - start)
+    return statistics.median(seconds) * 1000
+
+
+def compare(name, eager, session, x, repeat, rtol):
+    with torch.no_grad():
+        expected = eager(x)
+        actual = session(x)
+        eager_ms = latency(eager, x, repeat)
+    session_ms = latency(session, x, repeat)
+    error = relative_error(expected, actual)
+    print(
+        f"{name:>28}: max relative diff {error:.3g}, torch {eager_ms:.0f} ms, "
+        f"onnxruntime {session_ms:.0f} ms ({eager_ms / session_ms:.2f}x)"
+    )
+    return error <= rtol
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="parity and latency of the ONNX Runtime backend against "
+        "eager torch for the classifier and the visual extractor trunk"
+    )
+    parser.add_argument("--batch-sizes", default="1,4")
+    parser.add_argument(
+        "--img-sizes",
+        default="512x512,512x384",
+        help="classifier inputs, height x width: one dynamic graph covers all",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--rtol", type=float, default=1e-4)
+    parser.add_argument(
+        "--fold-bn",
+        action="store_true",
+        help="compare with the BatchNorm-folded torch models (MRG_FOLD_BN)",
+    )
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    img_model, img_cfg = cxr_init(MRG.img_cfg_path, MRG.img_weight_path)
+    img_model.eval()
+    visual_extractor = report_gen_cfg().model.visual_extractor.eval()
+    if args.fold_bn:
+        fold_bn_classifier(img_model)
+        fold_bn_visual_extractor(visual_extractor)
+    print(f"torch threads {torch.get_num_threads()}")
+
+    failed = []
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        classifier = OrtClassifier(
+            export_classifier(img_model, os.path.join(tmp, "classifier.onnx"))
+        )
+        trunk = OrtModule(
+            export_visual_extractor(
+                visual_extractor, os.path.join(tmp, "visual_extractor.onnx")
+            )
+        )
+        print(f"export and session setup {time.perf_counter() - start:.1f} s")
+
+        for batch_size in [int(size) for size in args.batch_sizes.split(",")]:
+            for img_size in args.img_sizes.split(","):
+                height, width = (int(side) for side in img_size.split("x"))
+                x = torch.randn(batch_size, 3, height, width)
+                name = f"classifier {batch_size}x{height}x{width}"
+                if not compare(
+                    name, img_model.predict, classifier, x, args.repeat, args.rtol
+                ):
+                    failed.append(name)
+            x = torch.rand(batch_size, 3, 224, 224)
+            name = f"visual_extractor {batch_size}x224x224"
+            if not compare(
+                name, visual_extractor.model, trunk, x, args.repeat, args.rtol
+            ):
+                failed.append(name)
+
+    finish(failed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import argparse
+import json
+import time
+import tracemalloc
+
+import numpy as np
+import torch
+from easydict import EasyDict as edict
+
+from bench.common import add_image_args, load_imgs
+from diagnosis_module.cxr.diagnosis import get_cxr_imgs
+from diagnosis_module.cxr.utils import transform
+
+CFG_PATH = "./diagnosis_module/cxr/config/JF.json"
+
+
+def reference_tensors(img, img_cfg):
+    # the per-image chain get_cxr_imgs replaced: torchvision for the report
+    # model, utils.transform for the classifier, then a copy into the batch
+    from torchvision import transforms
+
+    report_transpose = transforms.Compose(
+        [
+            transforms.Resize((224, 224)),
+            transforms.ToTensor(),
+            transforms.Normalize((0.485, 0.456, 0.406), (0.229, 0.224, 0.225)),
+        ]
+    )
+    img1 = report_transpose(img.convert("RGB"))
+    img2 = transform(np.asarray(img), img_cfg)
+    img2 = torch.from_numpy(np.ascontiguousarray(img2, dtype=np.float32))
+    return [img1.unsqueeze(dim=0), img2.unsqueeze(dim=0)]
+
+
+def reference_imgs(imgs, img_cfg):
+    tensors = [reference_tensors(img, img_cfg) for img in imgs]
+    img1 = torch.cat([t[0] for t in tensors], dim=0)
+    img2 = torch.cat([t[1] for t in tensors], dim=0)
+    return img1, img2
+
+
+def measure(fn, imgs, img_cfg, repeat):
+    fn(imgs, img_cfg)  # buffers, lookup tables and lazy imports
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(imgs, img_cfg)
+    seconds = (time.perf_counter() - start) / repeat / len(imgs)
+
+    # numpy reports its buffers to tracemalloc, torch's own allocator does not
+    tracemalloc.start()
+    fn(imgs, img_cfg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak / len(imgs)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="latency, allocations and parity of the preprocessing engine"
+    )
+    add_image_args(parser, batch_size=8)
+    parser.add_argument("--size", type=int, nargs=2, default=(2048, 1700))
+    parser.add_argument("--mode", choices=("L", "RGB"), default="L")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    img_cfg = edict(json.load(open(CFG_PATH)))
+    imgs = load_imgs(args, args.size, args.mode)
+
+    for name, fn in (("reference", reference_imgs), ("engine", get_cxr_imgs)):
+        seconds, peak = measure(fn, imgs, img_cfg, args.repeat)
+        print(
+            f"{name:>10}: {seconds * 1000:8.2f} ms/image  "
+            f"{peak / 2**20:8.2f} MiB peak numpy allocations/image"
+        )
+
+    expected, actual = reference_imgs(imgs, img_cfg), get_cxr_imgs(imgs, img_cfg)
+    for name, a, b in zip(("report", "classifier"), expected, actual):
+        print(f"{name:>10}: max abs diff {(a - b).abs().max().item():.3g}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import argparse
+import json
+
+import numpy as np
+import torch
+from easydict import EasyDict as edict
+
+from bench.common import add_image_args, finish, read_imgs, synthetic_imgs, timed
+from bench.preprocess import CFG_PATH, reference_imgs
+from diagnosis_module.cxr.preprocess import (
+    GAUSSIAN_KERNELS,
+    REPORT_STD,
+    batch_tensors,
+    equalize_hist,
+    gaussian_blur,
+)
+
+
+def check_exact():
+    # equalisation and blur reproduce OpenCV bit for bit, constant images too
+    import cv2
+
+    rng = np.random.default_rng(0)
+    failures = []
+    for shape in ((37, 53), (300, 200), (512, 700)):
+        images = rng.integers(30, 200, (3,) + shape, dtype=np.uint8)
+        images[2] = 77
+        equalized = equalize_hist(torch.from_numpy(images)).numpy()
+        if not all(
+            np.array_equal(out, cv2.equalizeHist(image))
+            for out, image in zip(equalized, images)
+        ):
+            failures.append(f"equalize_hist {shape}")
+        for k in GAUSSIAN_KERNELS:
+            blurred = gaussian_blur(torch.from_numpy(images), k).numpy()
+            if not all(
+                np.array_equal(out, cv2.GaussianBlur(image, (k, k), 0))
+                for out, image in zip(blurred, images)
+            ):
+                failures.append(f"gaussian_blur {k} {shape}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="parity of the batched torch preprocessing with transform()"
+    )
+    add_image_args(parser, batch_size=None)
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+
+    img_cfg = edict(json.load(open(CFG_PATH)))
+    failures = check_exact()
+
+    imgs = read_imgs(args.images)
+    if not imgs:
+        # mixed sizes and modes, so several shape groups in one batch
+        imgs = (
+            synthetic_imgs(3, (2048, 1700), "L")
+            + synthetic_imgs(2, (900, 1400), "RGB")
+            + synthetic_imgs(1, (512, 512), "L")
+        )
+
+    expected, reference_seconds = timed(reference_imgs, imgs, img_cfg)
+    actual, batched_seconds = timed(batch_tensors, imgs, img_cfg, args.device)
+    print(
+        f"{len(imgs)} images: reference {reference_seconds * 1000:.1f} ms, "
+        f"batched {batched_seconds * 1000:.1f} ms"
+    )
+
+    # the resizes may round a pixel to the neighbouring grey level
+    tolerances = (1 / 255 / min(REPORT_STD), 1 / (img_cfg.pixel_std or 1))
+    for name, a, b, tolerance in zip(
+        ("report", "classifier"), expected, actual, tolerances
+    ):
+        diff = (a - b.cpu()).abs()
+        print(
+            f"{name:>10}: max abs diff {diff.max().item():.4g} "
+            f"(tolerance {tolerance:.4g}), {(diff > 0).float().mean().item():.2%} "
+            f"of values differ"
+        )
+        if diff.max().item() > tolerance + 1e-6:
+            failures.append(name)
+
+    finish(failures)
+
+
+if __name__ == "__main__":
+    main()
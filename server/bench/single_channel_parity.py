@@ -0,0 +1,71 @@
+import argparse
+
+import torch
+
+from bench.common import (
+    add_image_args,
+    clone_inputs,
+    finish,
+    load_imgs,
+    per_group,
+    relative_error,
+    timed,
+)
+from diagnosis_module.cxr.diagnosis import cxr_infer, cxr_init, get_cxr_imgs
+from diagnosis_module.cxr.preprocess import REPORT_MEAN, REPORT_STD
+from optimize.single_channel import (
+    single_channel_classifier,
+    single_channel_visual_extractor,
+)
+from r2g.mrg_main import MRG
+from r2g.report_generate import report_gen_cfg
+
+
+def run(img_model, img_cfg, visual_extractor, imgs, channels):
+    img1, img2 = clone_inputs(*get_cxr_imgs(imgs, img_cfg, channels=channels))
+    classify = lambda batch: cxr_infer(img_model, batch, img_cfg)
+    with torch.no_grad():
+        probs, classifier_seconds = timed(per_group, classify, img2)
+        (patch_feats, avg_feats), report_seconds = timed(visual_extractor, img1)
+    return (probs, patch_feats, avg_feats), (classifier_seconds, report_seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="parity of the folded single-channel stems with 3 channels"
+    )
+    add_image_args(parser)
+    parser.add_argument("--rtol", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    imgs = load_imgs(args)
+
+    img_model, img_cfg = cxr_init(MRG.img_cfg_path, MRG.img_weight_path)
+    img_model.eval()
+    visual_extractor = report_gen_cfg().model.visual_extractor.eval()
+
+    expected, rgb_seconds = run(img_model, img_cfg, visual_extractor, imgs, 3)
+    single_channel_classifier(img_model)
+    single_channel_visual_extractor(visual_extractor, REPORT_MEAN, REPORT_STD)
+    actual, gray_seconds = run(img_model, img_cfg, visual_extractor, imgs, 1)
+
+    for name, rgb, gray in zip(
+        ("classifier", "visual_extractor"), rgb_seconds, gray_seconds
+    ):
+        print(
+            f"{name:>16}: 3 channels {rgb * 1000:.1f} ms, 1 channel {gray * 1000:.1f} ms"
+        )
+
+    failed = []
+    for name, a, b in zip(("probs", "patch_feats", "avg_feats"), expected, actual):
+        # relative to the output scale, the folded sums are only reordered
+        error = relative_error(a, b)
+        print(f"{name:>16}: max relative diff {error:.3g}")
+        if error > args.rtol:
+            failed.append(name)
+
+    finish(failed)
+
+
+if __name__ == "__main__":
+    main()
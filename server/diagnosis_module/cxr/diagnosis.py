@@ -1,15 +1,20 @@
-from torchvision import transforms
+import io
+from contextlib import nullcontext
+
 from PIL import Image
 import torch
 from diagnosis_module.cxr.models.classifier import Classifier
 from easydict import EasyDict as edict
 import json
-from diagnosis_module.cxr.utils import transform
+from diagnosis_module.cxr.preprocess import batch_tensors, preprocessor
+from model_io.loader import load_weights, resolve_weights
 import numpy as np
 import torch.nn.functional as F
 
 
 def get_img(img_path: str, idx: int = None):
+    from torchvision import transforms
+
     # idx should be 1 or 2
     img = Image.open(img_path).convert("RGB")
     report_transpose = transforms.Compose(
@@ -34,28 +39,76 @@ def get_img(img_path: str, idx: int = None):
     return res
 
 
-def get_cxr_img(img_path: str, img_cfg, idx: int = None):
+def decode_cxr_img(data: bytes):
+    # decode an uploaded image once, entirely in memory
+    img = Image.open(io.BytesIO(data))
+    img.load()
+    return img
+
+
+def load_cxr_img(img):
+    # accepts a file path, encoded bytes, a decoded PIL image or an
+    # (H, W[, C]) uint8 array
+    if isinstance(img, str):
+        img = Image.open(img)
+        img.load()
+    elif isinstance(img, (bytes, bytearray, memoryview)):
+        img = decode_cxr_img(img)
+    elif isinstance(img, np.ndarray):
+        img = Image.fromarray(img)
+    return img
+
+
+def cxr_img_tensors(img: Image.Image, img_cfg):
+    # both model inputs come from the same decoded buffer; copied out of the
+    # thread's reusable buffers since the caller may hold on to them
+    img1, img2 = get_cxr_imgs([img], img_cfg)
+    if isinstance(img2, list):
+        # aspect buckets: a single image is one group at its bucket's shape
+        ((_, img2),) = img2
+    return [img1.clone(), img2.clone()]
+
+
+def get_cxr_img(img, img_cfg, idx: int = None):
     # idx should be 1 or 2
-    img1 = Image.open(img_path).convert("RGB")
-    img2 = Image.open(img_path)
-    report_transpose = transforms.Compose(
-        [
-            transforms.Resize((224, 224)),
-            transforms.ToTensor(),
-            transforms.Normalize((0.485, 0.456, 0.406), (0.229, 0.224, 0.225)),
-        ]
-    )
-    img1 = report_transpose(img1)
-    img2 = np.array(img2)
-    img2 = transform(img2, img_cfg)
-    img2 = torch.tensor(img2, dtype=torch.float32)
-    res = [img1.unsqueeze(dim=0), img2.unsqueeze(dim=0)]
+    res = cxr_img_tensors(load_cxr_img(img), img_cfg)
     # img0 for text generation, img1 for inference
     if idx is not None:
         return res[idx - 1]
     return res
 
 
+def get_cxr_img_from_bytes(data: bytes, img_cfg, idx: int = None):
+    return get_cxr_img(data, img_cfg, idx)
+
+
+def get_cxr_img_from_array(img: np.ndarray, img_cfg, idx: int = None):
+    return get_cxr_img(img, img_cfg, idx)
+
+
+def get_cxr_imgs(
+    imgs: list, img_cfg, timer=nullcontext, batched=False, device="cpu", channels=3
+):
+    # one batch for each model; items may be anything load_cxr_img accepts.
+    # The tensors are views of this thread's preprocessing buffers and are
+    # overwritten by its next call. batched runs every stage once over the
+    # whole batch in torch on `device` instead, see batch_tensors. channels=1
+    # is for models with folded single-channel stems. With aspect buckets
+    # in img_cfg, the classifier batch is a list of (indices, tensor) groups.
+    with timer("load"):
+        imgs = [load_cxr_img(img) for img in imgs]
+    if batched:
+        with timer("transform"):
+            return batch_tensors(imgs, img_cfg, device, channels)
+
+    pre = preprocessor(img_cfg, channels)
+    img1, img2 = pre.batch(imgs)
+    for index, img in enumerate(imgs):
+        with timer("transform"):
+            pre.fill(index, img)
+    return img1, img2
+
+
 def get_pred(output, cfg):
     if cfg.criterion == "BCE" or cfg.criterion == "FL":
         # for num_class in cfg.num_classes:
@@ -75,16 +128,20 @@ def get_pred(output, cfg):
 
 def cxr_infer(img_model, img, imgcfg):
     img_model.eval()
-    outs_classes, _ = img_model(img)
-    assert isinstance(outs_classes, list)
-    # prob = np.zeros((len(imgcfg.Data_CLASSES), 1))
-    prob = get_pred(torch.Tensor(outs_classes), imgcfg)
-    return prob
+    with torch.no_grad():
+        # (N, num_tasks), the per-class heads fused into batched ops
+        logits = img_model.predict(img)
+    prob = get_pred(logits, imgcfg)
+    return prob.view(img.size(0), -1)
 
 
 def cxr_init(cfg_path, weight_path):
     imgcfg = edict(json.load(open(cfg_path)))
-    img_model = Classifier(imgcfg)
+    # built on the meta device: no memory is allocated or initialised for the
+    # parameters, the checkpoint tensors are attached as they are instead
+    with torch.device("meta"):
+        img_model = Classifier(imgcfg)
     # model.to(torch.cuda())
-    img_model.load_state_dict(torch.load(weight_path))
+    state_dict = load_weights(resolve_weights(weight_path))
+    img_model.load_state_dict(state_dict, assign=True)
     return img_model, imgcfg
@@ -205,6 +205,26 @@ class DenseNet(nn.Module):
         return out
 
 
+# '.'s are no longer allowed in module names, but pervious _DenseLayer
+# has keys 'norm.1', 'relu.1', 'conv.1', 'norm.2', 'relu.2', 'conv.2'.
+# They are also in the checkpoints in model_urls. This pattern is used
+# to find such keys.
+LEGACY_KEY_PATTERN = re.compile(
+    r"^(.*denselayer\d+\.(?:norm|relu|conv))\.((?:[12])\.(?:weight|bias|running_mean|running_var|num_batches_tracked))$"
+)  # noqa
+
+
+def remap_legacy_keys(state_dict):
+    # in place, also used to compact checkpoints saved with the old names
+    for key in list(state_dict.keys()):
+        res = LEGACY_KEY_PATTERN.match(key)
+        if res:
+            new_key = res.group(1) + res.group(2)
+            state_dict[new_key] = state_dict[key]
+            del state_dict[key]
+    return state_dict
+
+
 def densenet121(cfg, **kwargs):
     r"""Densenet-121 model from
     `"Densely Connected Convolutional Networks" <https://arxiv.org/pdf/1608.06993.pdf>`_  # noqa
@@ -220,20 +240,7 @@ def densenet121(cfg, **kwargs):
         **kwargs
     )
     if cfg.pretrained:
-        # '.'s are no longer allowed in module names, but pervious _DenseLayer
-        # has keys 'norm.1', 'relu.1', 'conv.1', 'norm.2', 'relu.2', 'conv.2'.
-        # They are also in the checkpoints in model_urls. This pattern is used
-        # to find such keys.
-        pattern = re.compile(
-            r"^(.*denselayer\d+\.(?:norm|relu|conv))\.((?:[12])\.(?:weight|bias|running_mean|running_var))$"
-        )  # noqa
-        state_dict = model_zoo.load_url(model_urls["densenet121"])
-        for key in list(state_dict.keys()):
-            res = pattern.match(key)
-            if res:
-                new_key = res.group(1) + res.group(2)
-                state_dict[new_key] = state_dict[key]
-                del state_dict[key]
+        state_dict = remap_legacy_keys(model_zoo.load_url(model_urls["densenet121"]))
         model.load_state_dict(state_dict, strict=False)
     return model
 
@@ -253,20 +260,7 @@ def densenet169(cfg, **kwargs):
         **kwargs
     )
     if cfg.pretrained:
-        # '.'s are no longer allowed in module names, but pervious _DenseLayer
-        # has keys 'norm.1', 'relu.1', 'conv.1', 'norm.2', 'relu.2', 'conv.2'.
-        # They are also in the checkpoints in model_urls. This pattern is used
-        # to find such keys.
-        pattern = re.compile(
-            r"^(.*denselayer\d+\.(?:norm|relu|conv))\.((?:[12])\.(?:weight|bias|running_mean|running_var))$"
-        )  # noqa
-        state_dict = model_zoo.load_url(model_urls["densenet169"])
-        for key in list(state_dict.keys()):
-            res = pattern.match(key)
-            if res:
-                new_key = res.group(1) + res.group(2)
-                state_dict[new_key] = state_dict[key]
-                del state_dict[key]
+        state_dict = remap_legacy_keys(model_zoo.load_url(model_urls["densenet169"]))
         model.load_state_dict(state_dict, strict=False)
     return model
 
@@ -286,20 +280,7 @@ def densenet201(cfg, **kwargs):
         **kwargs
     )
     if cfg.pretrained:
-        # '.'s are no longer allowed in module names, but pervious _DenseLayer
-        # has keys 'norm.1', 'relu.1', 'conv.1', 'norm.2', 'relu.2', 'conv.2'.
-        # They are also in the checkpoints in model_urls. This pattern is used
-        # to find such keys.
-        pattern = re.compile(
-            r"^(.*denselayer\d+\.(?:norm|relu|conv))\.((?:[12])\.(?:weight|bias|running_mean|running_var))$"
-        )  # noqa
-        state_dict = model_zoo.load_url(model_urls["densenet201"])
-        for key in list(state_dict.keys()):
-            res = pattern.match(key)
-            if res:
-                new_key = res.group(1) + res.group(2)
-                state_dict[new_key] = state_dict[key]
-                del state_dict[key]
+        state_dict = remap_legacy_keys(model_zoo.load_url(model_urls["densenet201"]))
         model.load_state_dict(state_dict, strict=False)
     return model
 
@@ -319,19 +300,6 @@ def densenet161(cfg, **kwargs):
         **kwargs
     )
     if cfg.pretrained:
-        # '.'s are no longer allowed in module names, but pervious _DenseLayer
-        # has keys 'norm.1', 'relu.1', 'conv.1', 'norm.2', 'relu.2', 'conv.2'.
-        # They are also in the checkpoints in model_urls. This pattern is used
-        # to find such keys.
-        pattern = re.compile(
-            r"^(.*denselayer\d+\.(?:norm|relu|conv))\.((?:[12])\.(?:weight|bias|running_mean|running_var))$"
-        )  # noqa
-        state_dict = model_zoo.load_url(model_urls["densenet161"])
-        for key in list(state_dict.keys()):
-            res = pattern.match(key)
-            if res:
-                new_key = res.group(1) + res.group(2)
-                state_dict[new_key] = state_dict[key]
-                del state_dict[key]
+        state_dict = remap_legacy_keys(model_zoo.load_url(model_urls["densenet161"]))
         model.load_state_dict(state_dict, strict=False)
     return model
@@ -1,27 +1,41 @@
+import importlib
+
+import torch
 from torch import nn
 
 import torch.nn.functional as F
-from diagnosis_module.cxr.models.backbone.densenet import densenet121
 from diagnosis_module.cxr.models.global_pool import GlobalPool
 from diagnosis_module.cxr.models.attention_map import AttentionMap
 
 
+# "module:builder", imported only when a config asks for that backbone
 BACKBONES = {
-    "densenet121": densenet121,
+    "densenet121": "diagnosis_module.cxr.models.backbone.densenet:densenet121",
+    "densenet169": "diagnosis_module.cxr.models.backbone.densenet:densenet169",
+    "densenet201": "diagnosis_module.cxr.models.backbone.densenet:densenet201",
+    "densenet161": "diagnosis_module.cxr.models.backbone.densenet:densenet161",
 }
 
 
 BACKBONES_TYPES = {
     "densenet121": "densenet",
+    "densenet169": "densenet",
+    "densenet201": "densenet",
+    "densenet161": "densenet",
 }
 
 
+def get_backbone(name):
+    module_name, builder = BACKBONES[name].split(":")
+    return getattr(importlib.import_module(module_name), builder)
+
+
 class Classifier(nn.Module):
 
     def __init__(self, cfg):
         super(Classifier, self).__init__()
         self.cfg = cfg
-        self.backbone = BACKBONES[cfg["backbone"]](cfg)
+        self.backbone = get_backbone(cfg["backbone"])(cfg)
         self.global_pool = GlobalPool(cfg)
         self.expand = 1
         if cfg.global_pool == "AVG_MAX":
@@ -31,6 +45,9 @@ class Classifier(nn.Module):
         self._init_classifier()
         self._init_bn()
         self._init_attention_map()
+        # fused_heads() as of cache_heads(), None until then
+        for name in ("head_weight", "head_bias", "head_scale", "head_shift"):
+            self.register_buffer(name, None, persistent=False)
 
     def _init_classifier(self):
         for index, num_class in enumerate(self.cfg.num_classes):
@@ -152,3 +169,78 @@ class Classifier(nn.Module):
             logits.append(logit)
 
         return logits, logit_maps
+
+    def fused_heads(self):
+        """
+        The per-class heads stacked for predict(): the eval-mode bn_i as
+        (K, D) scale and shift (None without fc_bn), and the 1x1 fc_i convs as
+        a (K, num_class, D) weight and (K, num_class) bias.
+        """
+        count = len(self.cfg.num_classes)
+        fcs = [getattr(self, "fc_" + str(index)) for index in range(count)]
+        weight = torch.stack([fc.weight.flatten(1) for fc in fcs])
+        bias = torch.stack([fc.bias for fc in fcs])
+        if not self.cfg.fc_bn:
+            return weight, bias, None, None
+
+        bns = [getattr(self, "bn_" + str(index)) for index in range(count)]
+        scale = torch.stack(
+            [bn.weight / torch.sqrt(bn.running_var + bn.eps) for bn in bns]
+        )
+        shift = torch.stack([bn.bias for bn in bns]) - scale * torch.stack(
+            [bn.running_mean for bn in bns]
+        )
+        return weight, bias, scale, shift
+
+    @torch.no_grad()
+    def cache_heads(self):
+        """
+        Keeps fused_heads() as buffers so predict() does not restack the
+        heads per batch. Call once the weights are final (loaded, on their
+        device); the buffers follow later .to() and share_memory() calls but
+        not changes to the bn_i/fc_i weights, which need another call.
+        """
+        (
+            self.head_weight,
+            self.head_bias,
+            self.head_scale,
+            self.head_shift,
+        ) = self.fused_heads()
+
+    def predict(self, x):
+        """
+        Inference-only forward: the (N, num_tasks) logits forward() returns as
+        a per-class list, with the heads of all classes run as one batched op
+        each for BN and the 1x1 conv. Class i still pools the feature map
+        after i + 1 passes through the attention map, as in forward().
+        """
+        num_classes = self.cfg.num_classes
+        if self.cfg.global_pool == "PCAM" or len(set(num_classes)) > 1:
+            # PCAM pools with each class's own logit map, and classes of
+            # different sizes do not stack
+            logits, _ = self(x)
+            return torch.cat(logits, dim=1)
+
+        feat_map = self.backbone(x)
+        if self.cfg.attention_map == "None":
+            # every class pools the same feature map
+            feat = self.global_pool(feat_map, None).flatten(1)
+            feats = feat.expand(len(num_classes), -1, -1)
+        else:
+            feats = []
+            for _ in num_classes:
+                feat_map = self.attention_map(feat_map)
+                feats.append(self.global_pool(feat_map, None).flatten(1))
+            # (K, N, D)
+            feats = torch.stack(feats)
+
+        if self.head_weight is not None:
+            weight, bias = self.head_weight, self.head_bias
+            scale, shift = self.head_scale, self.head_shift
+        else:
+            weight, bias, scale, shift = self.fused_heads()
+        if scale is not None:
+            feats = torch.addcmul(shift[:, None], feats, scale[:, None])
+        # (K, N, num_class) -> (N, K * num_class), ordered like torch.cat
+        logits = torch.baddbmm(bias[:, None], feats, weight.transpose(1, 2))
+        return logits.transpose(0, 1).reshape(x.size(0), -1).contiguous()
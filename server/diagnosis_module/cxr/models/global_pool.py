@@ -41,9 +41,10 @@ class LogSumExpPool(nn.Module):
         area = 1.0 / (H * W)
         g = self.gamma
 
-        # TODO: split dim=(-1, -2) for onnx.export
+        # summed one axis at a time, as in PcamPool, for onnx export
         return m + 1 / g * torch.log(
-            area * torch.sum(torch.exp(g * value0), dim=(-1, -2), keepdim=True)
+            area
+            * torch.exp(g * value0).sum(dim=-1, keepdim=True).sum(dim=-2, keepdim=True)
         )
 
 
@@ -65,8 +66,9 @@ class ExpPool(nn.Module):
         m, _ = torch.max(feat_map, dim=-1, keepdim=True)[0].max(dim=-2, keepdim=True)
 
         # caculate the sum of exp(xi)
-        # TODO: split dim=(-1, -2) for onnx.export
-        sum_exp = torch.sum(torch.exp(feat_map - m), dim=(-1, -2), keepdim=True)
+        sum_exp = (
+            torch.exp(feat_map - m).sum(dim=-1, keepdim=True).sum(dim=-2, keepdim=True)
+        )
 
         # prevent from dividing by zero
         sum_exp += EPSILON
@@ -75,8 +77,7 @@ class ExpPool(nn.Module):
         exp_weight = torch.exp(feat_map - m) / sum_exp
         weighted_value = feat_map * exp_weight
 
-        # TODO: split dim=(-1, -2) for onnx.export
-        return torch.sum(weighted_value, dim=(-1, -2), keepdim=True)
+        return weighted_value.sum(dim=-1, keepdim=True).sum(dim=-2, keepdim=True)
 
 
 class LinearPool(nn.Module):
@@ -95,8 +96,7 @@ class LinearPool(nn.Module):
 
         # sum feat_map's last two dimention into a scalar
         # so the shape of sum_input is (N,C,1,1)
-        # TODO: split dim=(-1, -2) for onnx.export
-        sum_input = torch.sum(feat_map, dim=(-1, -2), keepdim=True)
+        sum_input = feat_map.sum(dim=-1, keepdim=True).sum(dim=-2, keepdim=True)
 
         # prevent from dividing by zero
         sum_input += EPSILON
@@ -105,8 +105,7 @@ class LinearPool(nn.Module):
         linear_weight = feat_map / sum_input
         weighted_value = feat_map * linear_weight
 
-        # TODO: split dim=(-1, -2) for onnx.export
-        return torch.sum(weighted_value, dim=(-1, -2), keepdim=True)
+        return weighted_value.sum(dim=-1, keepdim=True).sum(dim=-2, keepdim=True)
 
 
 class GlobalPool(nn.Module):
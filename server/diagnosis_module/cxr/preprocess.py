@@ -0,0 +1,372 @@
+import copy
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+from diagnosis_module.cxr.utils import (
+    aspect_buckets,
+    fit_size,
+    nearest_bucket,
+    transform,
+)
+from serving import native
+
+# inference runs on native threads, each gets its own buffers
+_local = native.threading.local()
+
+REPORT_SIZE = (224, 224)
+REPORT_MEAN = (0.485, 0.456, 0.406)
+REPORT_STD = (0.229, 0.224, 0.225)
+
+# OpenCV's fixed sigma=0 kernels for small sizes, scaled to integers, and the
+# shift dividing by their square sum: its uint8 blur is computed exactly in
+# fixed point with these and rounded once, so integer arithmetic matches it
+GAUSSIAN_KERNELS = {
+    1: ((1,), 0),
+    3: ((1, 2, 1), 4),
+    5: ((1, 4, 6, 4, 1), 8),
+    7: ((2, 7, 14, 18, 14, 7, 2), 12),
+}
+
+
+def border_value(cfg):
+    # np.pad casts the fill value to the uint8 image the same way
+    pad = cfg.pixel_mean if cfg.border_pad == "pixel_mean" else 0
+    return np.array(pad).astype(np.uint8)
+
+
+def classifier_lut(cfg):
+    # uint8 pixel -> normalised float32, the same float32 arithmetic transform()
+    # does per pixel, done once per value
+    lut = np.arange(256, dtype=np.uint8).astype(np.float32) - cfg.pixel_mean
+    if cfg.pixel_std:
+        lut /= cfg.pixel_std
+    return lut
+
+
+def report_luts(normalize=True):
+    # one table per channel, computed with the ToTensor + Normalize ops the
+    # report model was trained with, so the results are bit for bit the same.
+    # Without normalize, a single ToTensor table for a folded stem.
+    values = torch.arange(256, dtype=torch.uint8).to(torch.float32).div(255)
+    if not normalize:
+        return values[None].numpy()
+    values = values.expand(3, 256).clone()
+    mean = torch.as_tensor(REPORT_MEAN, dtype=torch.float32)[:, None]
+    std = torch.as_tensor(REPORT_STD, dtype=torch.float32)[:, None]
+    return values.sub_(mean).div_(std).numpy()
+
+
+def report_image(img, channels=3):
+    # RGB and grey images are resized as they are, a grey image is the same
+    # in every channel of its RGB conversion. A single channel is the
+    # luminance: exact for grey images stored as RGB, and for colour ones
+    # (screenshots, annotated exports) the closest grey image to what the
+    # 3-channel model would see, rather than just its red channel.
+    if img.mode not in ("L", "RGB"):
+        img = img.convert("RGB")
+    if channels == 1 and img.mode == "RGB":
+        img = img.convert("L")
+    return img
+
+
+class Preprocessor:
+    """
+    Builds both model inputs for a batch of decoded images straight into
+    preallocated float buffers: the grey image is equalised and blurred into
+    scratch buffers, resized directly into a canvas that already holds the
+    padding, and normalised with a lookup table into the batch buffer the
+    classifier tensor is a view of. The buffers are reused by the next batch,
+    so the tensors are only valid until then. With channels=1 each input is
+    the grey image once, for models whose stem was folded to one channel.
+    With aspect buckets every bucket has its own canvas and batch buffer.
+    """
+
+    def __init__(self, cfg, channels=3):
+        self.cfg = cfg
+        self.channels = channels
+        self.buckets = aspect_buckets(cfg)
+        # other border modes (reflect, edge, ...) depend on the resized pixels
+        self.letterbox = cfg.border_pad in ("zero", "pixel_mean")
+        self.pad_value = border_value(cfg)
+        self.lut = classifier_lut(cfg)
+        self.report_luts = report_luts(normalize=channels == 3)
+        self._canvases = {}
+        self._scratch = [np.empty(0, dtype=np.uint8), np.empty(0, dtype=np.uint8)]
+        self._img1 = np.empty((0, channels) + REPORT_SIZE, dtype=np.float32)
+        # per bucket shape, and where fill() writes each image of the batch
+        self._img2 = {}
+        self._slots = {}
+
+    def bucket(self, img):
+        w, h = img.size
+        return nearest_bucket(h, w, self.buckets)
+
+    def batch(self, imgs):
+        """
+        (report, classifier) tensors for the decoded `imgs`, filled by fill().
+        With aspect buckets the classifier input is a list of (indices,
+        tensor) groups instead, one per bucket the batch uses.
+        """
+        if len(self._img1) < len(imgs):
+            self._img1 = np.empty((len(imgs),) + self._img1.shape[1:], dtype=np.float32)
+        groups = {}
+        for index, img in enumerate(imgs):
+            groups.setdefault(self.bucket(img), []).append(index)
+
+        img2 = []
+        self._slots = {}
+        for shape, indices in groups.items():
+            buffer = self._img2.get(shape)
+            if buffer is None or len(buffer) < len(indices):
+                buffer = self._img2[shape] = np.empty(
+                    (len(indices), self.channels) + shape, dtype=np.float32
+                )
+            for slot, index in enumerate(indices):
+                self._slots[index] = buffer[slot]
+            img2.append((indices, torch.from_numpy(buffer[: len(indices)])))
+
+        img1 = torch.from_numpy(self._img1[: len(imgs)])
+        if len(self.buckets) == 1:
+            return img1, img2[0][1]
+        return img1, img2
+
+    def fill(self, index, img: Image.Image):
+        self.fill_report(self._img1[index], img)
+        self.fill_classifier(self._slots[index], img)
+
+    def fill_report(self, out, img):
+        img = report_image(img, self.channels)
+        resized = np.asarray(img.resize(REPORT_SIZE[::-1], Image.BILINEAR))
+        for c in range(self.channels):
+            channel = resized if resized.ndim == 2 else resized[:, :, c]
+            np.take(self.report_luts[c], channel, out=out[c], mode="clip")
+
+    def gray(self, img):
+        # the classifier only looks at the first channel
+        if len(img.getbands()) > 1:
+            img = img.getchannel(0)
+        return np.asarray(img)
+
+    def scratch(self, index, shape):
+        size = shape[0] * shape[1]
+        if self._scratch[index].size < size:
+            self._scratch[index] = np.empty(size, dtype=np.uint8)
+        return self._scratch[index][:size].reshape(shape)
+
+    def canvas(self, shape):
+        if shape not in self._canvases:
+            self._canvases[shape] = np.empty(shape, dtype=np.uint8)
+        return self._canvases[shape]
+
+    def fill_classifier(self, out, img):
+        import cv2
+
+        cfg = self.cfg
+        image = self.gray(img)
+        if not self.letterbox:
+            out[:] = transform(image, cfg)[: self.channels]
+            return
+
+        assert image.ndim == 2, "image must be gray image"
+        if cfg.use_equalizeHist:
+            image = cv2.equalizeHist(image, dst=self.scratch(0, image.shape))
+        if cfg.gaussian_blur > 0:
+            k = cfg.gaussian_blur
+            image = cv2.GaussianBlur(image, (k, k), 0, dst=self.scratch(1, image.shape))
+
+        # fix_ratio: one side fills the bucket, the rest is padding
+        canvas = self.canvas(out.shape[-2:])
+        h_, w_ = fit_size(*image.shape, canvas.shape)
+        canvas[h_:, :] = self.pad_value
+        canvas[:h_, w_:] = self.pad_value
+        cv2.resize(
+            image, (w_, h_), dst=canvas[:h_, :w_], interpolation=cv2.INTER_LINEAR
+        )
+
+        # uint8 indices are always in range, clip skips the bounds check
+        np.take(self.lut, canvas, out=out[0], mode="clip")
+        out[1:] = out[0]
+
+
+def preprocessor(cfg, channels=3):
+    # the calling thread's Preprocessor for `cfg`, keyed on the settings it
+    # uses: a cfg changed in place (e.g. given aspect buckets) gets a new one
+    preprocessors = getattr(_local, "preprocessors", None)
+    if preprocessors is None:
+        preprocessors = _local.preprocessors = {}
+    key = (
+        channels,
+        tuple(aspect_buckets(cfg)),
+        cfg.border_pad,
+        cfg.pixel_mean,
+        cfg.pixel_std,
+        cfg.use_equalizeHist,
+        cfg.gaussian_blur,
+    )
+    if key not in preprocessors:
+        # a copy, later changes to cfg must not reach a cached Preprocessor
+        preprocessors[key] = Preprocessor(copy.deepcopy(cfg), channels)
+    return preprocessors[key]
+
+
+def equalize_hist(images):
+    """
+    cv2.equalizeHist over a (N, H, W) uint8 batch, one histogram per image,
+    with OpenCV's float32 scale and round-half-even so the result is exact.
+    """
+    total = images[0].numel()
+    hist = torch.stack(
+        [torch.bincount(image.view(-1), minlength=256) for image in images]
+    )
+
+    first = (hist > 0).to(torch.uint8).argmax(dim=1, keepdim=True)
+    first_count = hist.gather(1, first)
+    cumulative = hist.cumsum(dim=1)
+    # a true division, `255.0 / tensor` multiplies by the reciprocal instead
+    scale = torch.full_like(hist[:, :1], 255, dtype=torch.float32)
+    scale = scale.div_((total - first_count).to(torch.float32))
+    sums = (cumulative - cumulative.gather(1, first)).to(torch.float32)
+    luts = torch.round(sums * scale).clamp_(0, 255).to(torch.uint8)
+    # a constant image keeps its value
+    luts = torch.where(first_count == total, first.to(torch.uint8), luts)
+    return torch.stack([lut[image.long()] for lut, image in zip(luts, images)])
+
+
+def reflect_101(size, pad, device=None):
+    # indices of cv2.BORDER_DEFAULT padding: gfedcb|abcdefgh|gfedcba
+    index = torch.arange(-pad, size + pad, device=device).abs()
+    return torch.where(index >= size, 2 * (size - 1) - index, index)
+
+
+def gaussian_blur(images, ksize):
+    """
+    cv2.GaussianBlur(image, (ksize, ksize), 0) over a (N, H, W) uint8 batch:
+    the separable kernel in integer arithmetic, rounded once like OpenCV.
+    """
+    kernel, shift = GAUSSIAN_KERNELS[ksize]
+    if shift == 0:
+        return images
+    pad = ksize // 2
+    h, w = images.shape[-2:]
+    # int16 holds the 3x3 sums, the larger kernels need int32
+    dtype = torch.int16 if 255 << shift < 1 << 15 else torch.int32
+    x = images.index_select(-1, reflect_101(w, pad, images.device)).to(dtype)
+    rows = x[..., :w] * kernel[0]
+    for i, k in enumerate(kernel[1:], 1):
+        rows.add_(x[..., i : i + w], alpha=k)
+    rows = rows.index_select(-2, reflect_101(h, pad, images.device))
+    blurred = rows[..., :h, :] * kernel[0]
+    for i, k in enumerate(kernel[1:], 1):
+        blurred.add_(rows[..., i : i + h, :], alpha=k)
+    blurred = blurred.to(torch.int32).add_(1 << (shift - 1))
+    return blurred.bitwise_right_shift_(shift).to(torch.uint8)
+
+
+def round_to_uint8(images):
+    return images.add_(0.5).floor_().clamp_(0, 255).to(torch.uint8)
+
+
+def letterbox(images, size, pad_value):
+    """
+    fix_ratio + border_pad over a (N, H, W) uint8 batch of one shape: bilinear
+    resize to fill `size` along one side, into a canvas filled with pad_value.
+    Same sampling as cv2.INTER_LINEAR, but without its fixed-point weights, so
+    pixels may differ from OpenCV by one grey level.
+    """
+    n, h, w = images.shape
+    h_, w_ = fit_size(h, w, size)
+    resized = F.interpolate(
+        images[:, None].to(torch.float32),
+        size=(h_, w_),
+        mode="bilinear",
+        align_corners=False,
+    )
+    canvas = images.new_full((n,) + tuple(size), int(pad_value))
+    canvas[:, :h_, :w_] = round_to_uint8(resized[:, 0])
+    return canvas
+
+
+def report_resize(images):
+    # transforms.Resize((224, 224)) on a PIL image, on a (N, C, H, W) uint8
+    # batch: antialiased bilinear like PIL, within one grey level of it
+    resized = F.interpolate(
+        images.to(torch.float32),
+        size=REPORT_SIZE,
+        mode="bilinear",
+        align_corners=False,
+        antialias=True,
+    )
+    return round_to_uint8(resized)
+
+
+def batchable(cfg):
+    # other border modes and larger blur kernels take the per-image path
+    return cfg.border_pad in ("zero", "pixel_mean") and (
+        cfg.gaussian_blur <= 0 or cfg.gaussian_blur in GAUSSIAN_KERNELS
+    )
+
+
+def batch_tensors(imgs, cfg, device="cpu", channels=3):
+    """
+    (report, classifier) batches for decoded PIL images like
+    Preprocessor.fill, computed on `device` with each stage run once over
+    every group of images of the same size instead of once per image.
+    Equalisation, blur and padding match OpenCV exactly, the two resizes are
+    within one grey level of OpenCV and PIL. The classifier input is grouped
+    by aspect bucket like Preprocessor.batch.
+    """
+    if not batchable(cfg):
+        pre = Preprocessor(cfg, channels)
+        img1, img2 = pre.batch(imgs)
+        for index, img in enumerate(imgs):
+            pre.fill(index, img)
+        if isinstance(img2, list):
+            return img1.to(device), [(i, t.to(device)) for i, t in img2]
+        return img1.to(device), img2.to(device)
+
+    lut = torch.from_numpy(classifier_lut(cfg)).to(device)
+    luts = torch.from_numpy(report_luts(normalize=channels == 3)).to(device)
+    img1 = torch.empty((len(imgs), channels) + REPORT_SIZE, device=device)
+    buckets = aspect_buckets(cfg)
+    img2, parts = None, {}
+    if len(buckets) == 1:
+        img2 = torch.empty((len(imgs), channels) + buckets[0], device=device)
+
+    groups = {}
+    for index, img in enumerate(imgs):
+        gray = np.asarray(img.getchannel(0) if len(img.getbands()) > 1 else img)
+        report = np.asarray(report_image(img, channels))
+        groups.setdefault((gray.shape, report.ndim), []).append((index, gray, report))
+
+    for group in groups.values():
+        index = torch.tensor([i for i, _, _ in group], device=device)
+        gray = torch.from_numpy(np.stack([g for _, g, _ in group])).to(device)
+        report = torch.from_numpy(np.stack([r for _, _, r in group])).to(device)
+        report = report[:, None] if report.ndim == 3 else report.permute(0, 3, 1, 2)
+
+        if cfg.use_equalizeHist:
+            gray = equalize_hist(gray)
+        if cfg.gaussian_blur > 0:
+            gray = gaussian_blur(gray, cfg.gaussian_blur)
+        shape = nearest_bucket(*gray.shape[-2:], buckets)
+        canvas = letterbox(gray, shape, border_value(cfg))
+        normalized = lut[canvas.long()][:, None].expand(-1, channels, -1, -1)
+        if img2 is not None:
+            img2[index] = normalized
+        else:
+            indices, tensors = parts.setdefault(shape, ([], []))
+            indices.extend(index.tolist())
+            tensors.append(normalized)
+
+        # a grey image is the same in every channel of its RGB conversion
+        resized = report_resize(report).long()
+        img1[index] = torch.stack(
+            [luts[c][resized[:, c % resized.shape[1]]] for c in range(channels)],
+            dim=1,
+        )
+    if img2 is None:
+        img2 = [(indices, torch.cat(tensors)) for indices, tensors in parts.values()]
+    return img1, img2
@@ -1,28 +1,56 @@
+import math
+
 import numpy as np
-import cv2
 
 
-def border_pad(image, cfg):
+def aspect_buckets(cfg):
+    # (height, width) canvases an image may be letterboxed into: the long_side
+    # square plus cfg.aspect_buckets, if any. Sides are multiples of 128 so
+    # that the FPA pyramid over the /32 feature map lines up again.
+    buckets = [(cfg.long_side, cfg.long_side)]
+    for h, w in cfg.get("aspect_buckets") or []:
+        if h % 128 or w % 128:
+            raise ValueError(f"aspect bucket {h}x{w} is not a multiple of 128")
+        if (h, w) not in buckets:
+            buckets.append((h, w))
+    return buckets
+
+
+def nearest_bucket(h, w, buckets):
+    # the bucket closest in aspect ratio, the earlier one on ties
+    return min(buckets, key=lambda size: abs(math.log(h * size[1] / (w * size[0]))))
+
+
+def fit_size(h, w, size):
+    # (h, w) resized to fill `size` along one side, aspect ratio kept
+    bh, bw = size
+    if h * bw >= w * bh:
+        return bh, round(bh / (h * 1.0 / w))
+    return round(bw / (w * 1.0 / h)), bw
+
+
+def border_pad(image, cfg, size=None):
     h, w, c = image.shape
+    height, width = size or (cfg.long_side, cfg.long_side)
 
     if cfg.border_pad == "zero":
         image = np.pad(
             image,
-            ((0, cfg.long_side - h), (0, cfg.long_side - w), (0, 0)),
+            ((0, height - h), (0, width - w), (0, 0)),
             mode="constant",
             constant_values=0.0,
         )
     elif cfg.border_pad == "pixel_mean":
         image = np.pad(
             image,
-            ((0, cfg.long_side - h), (0, cfg.long_side - w), (0, 0)),
+            ((0, height - h), (0, width - w), (0, 0)),
             mode="constant",
             constant_values=cfg.pixel_mean,
         )
     else:
         image = np.pad(
             image,
-            ((0, cfg.long_side - h), (0, cfg.long_side - w), (0, 0)),
+            ((0, height - h), (0, width - w), (0, 0)),
             mode=cfg.border_pad,
         )
 
@@ -30,25 +58,22 @@ def border_pad(image, cfg):
 
 
 def fix_ratio(image, cfg):
-    h, w, c = image.shape
+    import cv2
 
-    if h >= w:
-        ratio = h * 1.0 / w
-        h_ = cfg.long_side
-        w_ = round(h_ / ratio)
-    else:
-        ratio = w * 1.0 / h
-        w_ = cfg.long_side
-        h_ = round(w_ / ratio)
+    h, w, c = image.shape
+    size = nearest_bucket(h, w, aspect_buckets(cfg))
+    h_, w_ = fit_size(h, w, size)
 
     image = cv2.resize(image, dsize=(w_, h_), interpolation=cv2.INTER_LINEAR)
-    image = border_pad(image, cfg)
+    image = border_pad(image, cfg, size)
 
     return image
 
 
 def transform(image, cfg):
-    print(image.ndim)
+    # opencv is only needed once images arrive, not to import the server
+    import cv2
+
     if image.ndim == 3:
         image = image[:, :, 0]
     assert image.ndim == 2, "image must be gray image"
@@ -1,3 +1,4 @@
+import gc
 import os
 
 from dotenv import load_dotenv
@@ -6,7 +7,7 @@ load_dotenv()
 
 
 # Set the number of workers to the number of CPUs available
-workers = 1
+workers = int(os.environ.get("WORKERS", 1))
 
 # Specify the worker class to use Eventlet
 worker_class = "eventlet"
@@ -16,3 +17,30 @@ timeout = 5400
 
 # Bind Gunicorn to listen on all network interfaces on port <PORT>
 bind = f"0.0.0.0:{os.environ['PORT']}"
+
+# Load wsgi (and with it both models) once in the master. The weights are moved
+# to shared memory there and every forked worker attaches to the same pages.
+preload_app = os.environ.get("MRG_PRELOAD", "0") == "1"
+
+
+def pre_fork(server, worker):
+    # keep the collector from touching (and so copying) the preloaded objects
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import torch
+
+    # torch drops to a single intra-op thread in a forked child, so give each
+    # worker its share of the cores back
+    torch_threads = int(os.environ.get("MRG_TORCH_THREADS", 0))
+    if torch_threads <= 0:
+        torch_threads = max(1, (os.cpu_count() or 1) // workers)
+    torch.set_num_threads(torch_threads)
+
+
+def post_worker_init(worker):
+    # each worker warms its models up before /readyz reports it ready
+    from wsgi import start_serving
+
+    start_serving()
@@ -0,0 +1,148 @@
+import argparse
+import hashlib
+import json
+import os
+
+import torch
+from safetensors.torch import save_file
+
+from model_io.loader import ALIASES_KEY, load_weights, upcast
+
+DTYPES = {"fp32": torch.float32, "bf16": torch.bfloat16, "fp16": torch.float16}
+
+MANIFEST_VERSION = 1
+
+
+def split_aliases(state_dict):
+    # safetensors refuses tensors sharing storage (e.g. the memory module the
+    # report model registers twice), keep one copy and record the other names
+    unique, aliases, seen = {}, {}, {}
+    for name, tensor in state_dict.items():
+        key = (
+            tensor.untyped_storage().data_ptr(),
+            tensor.storage_offset(),
+            tensor.shape,
+            tensor.stride(),
+            tensor.dtype,
+        )
+        if key in seen:
+            aliases[name] = seen[key]
+        else:
+            seen[key] = name
+            # cloned, views into one larger storage count as shared too
+            unique[name] = tensor.contiguous().clone()
+    return unique, aliases
+
+
+def compact(state_dict, dtype="fp32", model=None):
+    # only the inference weights: no DataParallel prefixes, current DenseNet
+    # key names, floating point tensors in the requested precision
+    state_dict = {
+        (name[len("module.") :] if name.startswith("module.") else name): tensor
+        for name, tensor in state_dict.items()
+    }
+    if model == "classifier":
+        from diagnosis_module.cxr.models.backbone.densenet import remap_legacy_keys
+
+        state_dict = remap_legacy_keys(state_dict)
+    # converted once per tensor, not once per name: tied tensors must still
+    # share storage for split_aliases to record them (upcast casts either way)
+    return upcast(state_dict, DTYPES[dtype])
+
+
+def source_config(model):
+    if model == "classifier":
+        from r2g.mrg_main import MRG
+
+        with open(MRG.img_cfg_path) as f:
+            return json.load(f)
+    if model == "report":
+        from r2g.report_generate import REPORT_GEN_CFG
+
+        return REPORT_GEN_CFG
+    return None
+
+
+def sha256sum(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def convert(src, dst=None, dtype="fp32", model=None):
+    """
+    Writes the slim inference checkpoint of `src` to `dst` (safetensors) and a
+    `<dst>.manifest.json` next to it with checksums and the source config.
+    """
+    dst = dst or os.path.splitext(src)[0] + ".safetensors"
+    tensors, aliases = split_aliases(compact(load_weights(src), dtype, model))
+    save_file(
+        tensors,
+        dst,
+        metadata={
+            ALIASES_KEY: json.dumps(aliases),
+            "source": os.path.basename(src),
+            "dtype": dtype,
+        },
+    )
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "file": os.path.basename(dst),
+        "sha256": sha256sum(dst),
+        "bytes": os.path.getsize(dst),
+        "dtype": dtype,
+        "model": model,
+        "tensors": len(tensors),
+        "aliases": len(aliases),
+        "parameters": sum(t.numel() for t in tensors.values()),
+        "source": {
+            "file": os.path.basename(src),
+            "sha256": sha256sum(src),
+            "bytes": os.path.getsize(src),
+        },
+        "config": source_config(model),
+    }
+    with open(f"{dst}.manifest.json", "w") as f:
+        json.dump(manifest, f, indent=2, default=str)
+    return dst
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="compact .pth checkpoints into slim, memory-mappable "
+        ".safetensors inference checkpoints with a manifest"
+    )
+    parser.add_argument("src", nargs="+", help=".pth checkpoints")
+    parser.add_argument(
+        "--out",
+        help="output file, only with a single src (default: src with a .safetensors suffix)",
+    )
+    parser.add_argument(
+        "--dtype",
+        choices=sorted(DTYPES),
+        default="fp32",
+        help="precision of the stored floating point weights, loading upcasts "
+        "them to fp32 again",
+    )
+    parser.add_argument(
+        "--model",
+        choices=["classifier", "report"],
+        help="which model the checkpoint belongs to: applies the DenseNet key "
+        "remap for the classifier and records the model config in the manifest",
+    )
+    args = parser.parse_args()
+    if args.out and len(args.src) > 1:
+        parser.error("--out takes a single src")
+    for src in args.src:
+        dst = convert(src, args.out, args.dtype, args.model)
+        print(
+            f"{src} ({os.path.getsize(src) >> 20} MB) -> {dst} "
+            f"({os.path.getsize(dst) >> 20} MB)"
+        )
+
+
+if __name__ == "__main__":
+    main()
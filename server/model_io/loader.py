@@ -0,0 +1,147 @@
+import bisect
+import json
+import mmap
+import os
+import struct
+
+import torch
+
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+# metadata key under which the converter records tensors that share storage
+ALIASES_KEY = "aliases"
+
+
+def resolve_weights(path):
+    # a converted checkpoint next to the original one takes precedence
+    converted = os.path.splitext(path)[0] + ".safetensors"
+    if os.path.exists(converted):
+        return converted
+    return path
+
+
+def read_safetensors_header(path):
+    with open(path, "rb") as f:
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+    return header, 8 + header_size
+
+
+def mapped_ranges():
+    """
+    Sorted (begin, end) address ranges of this process's file-backed memory
+    mappings, e.g. memory-mapped checkpoints. Shared memory segments do not
+    count; empty where /proc is not available.
+    """
+    ranges = []
+    try:
+        with open("/proc/self/maps") as f:
+            for line in f:
+                fields = line.split(None, 5)
+                # address perms offset dev inode [path], inode 0 is anonymous
+                if len(fields) < 6 or fields[4] == "0":
+                    continue
+                path = fields[5].strip()
+                if path.startswith(("[", "/dev/shm/", "/memfd:")) or path.endswith(
+                    "(deleted)"
+                ):
+                    continue
+                begin, end = (int(address, 16) for address in fields[0].split("-"))
+                ranges.append((begin, end))
+    except OSError:
+        pass
+    return sorted(ranges)
+
+
+def is_file_backed(tensor, ranges):
+    # whether tensor's storage lies in one of mapped_ranges()
+    ptr = tensor.untyped_storage().data_ptr()
+    index = bisect.bisect_right(ranges, (ptr, float("inf"))) - 1
+    return index >= 0 and ptr < ranges[index][1]
+
+
+def load_safetensors(path):
+    """
+    Maps a .safetensors file into memory and returns a state dict whose
+    tensors are views of the mapping. Nothing is copied: pages are read on
+    first touch and shared through the page cache with every other process
+    mapping the same file. The mapping is private, so writes stay local.
+    """
+    header, data_start = read_safetensors_header(path)
+    metadata = header.pop("__metadata__", None) or {}
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    state_dict = {}
+    for name, info in header.items():
+        begin, end = info["data_offsets"]
+        dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        if begin == end:
+            state_dict[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        tensor = torch.frombuffer(
+            buffer,
+            dtype=dtype,
+            count=(end - begin) // dtype.itemsize,
+            offset=data_start + begin,
+        )
+        state_dict[name] = tensor.view(info["shape"])
+
+    for alias, name in json.loads(metadata.get(ALIASES_KEY, "{}")).items():
+        state_dict[alias] = state_dict[name]
+    return state_dict
+
+
+def upcast(state_dict, dtype=torch.float32):
+    # the models run in float32, half precision checkpoints only save disk and
+    # transfer time. Upcast tensors are copies, float32 ones stay mapped.
+    # Names viewing the same tensor (tied weights, restored aliases) share one
+    # upcast copy instead of getting one each.
+    upcast_views, result = {}, {}
+    for name, tensor in state_dict.items():
+        if not tensor.is_floating_point() or tensor.dtype == dtype:
+            result[name] = tensor
+            continue
+        key = (
+            tensor.untyped_storage().data_ptr(),
+            tensor.storage_offset(),
+            tensor.shape,
+            tensor.stride(),
+            tensor.dtype,
+        )
+        if key not in upcast_views:
+            upcast_views[key] = tensor.to(dtype)
+        result[name] = upcast_views[key]
+    return result
+
+
+def load_weights(path):
+    """
+    State dict of a checkpoint, for load_state_dict(..., assign=True). Reads
+    .safetensors files zero-copy, anything else with torch.load; a training
+    checkpoint's "state_dict" entry is unwrapped and half precision weights
+    are upcast to float32.
+    """
+    if path.endswith(".safetensors"):
+        return upcast(load_safetensors(path))
+    try:
+        # lazily backed by the file as well, the rest of a training
+        # checkpoint (optimizer state etc.) is never paged in
+        checkpoint = torch.load(path, map_location="cpu", mmap=True)
+    except RuntimeError:
+        # legacy, non zip checkpoints cannot be mapped
+        checkpoint = torch.load(path, map_location="cpu")
+    if isinstance(checkpoint, dict) and "state_dict" in checkpoint:
+        checkpoint = checkpoint["state_dict"]
+    return upcast(checkpoint)
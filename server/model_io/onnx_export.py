@@ -0,0 +1,132 @@
+import argparse
+import copy
+import inspect
+import os
+
+import torch
+import torch.nn as nn
+
+from diagnosis_module.cxr.preprocess import REPORT_MEAN, REPORT_SIZE, REPORT_STD
+from optimize.fold_bn import fold_bn, fold_bn_classifier
+from optimize.single_channel import (
+    single_channel_classifier,
+    single_channel_visual_extractor,
+)
+
+OPSET_VERSION = 17
+
+
+class ClassifierLogits(nn.Module):
+    # the exported graph is Classifier.predict: images in, (N, num_tasks) out
+    def __init__(self, model):
+        super(ClassifierLogits, self).__init__()
+        self.model = model
+
+    def forward(self, images):
+        return self.model.predict(images)
+
+
+def export(module, example, path, output_names, dynamic_axes):
+    kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        # the TorchScript exporter, the only one the pinned torch has
+        kwargs["dynamo"] = False
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # written under a private name and renamed, workers may export at once
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with torch.no_grad():
+        torch.onnx.export(
+            module,
+            (example,),
+            tmp,
+            input_names=["images"],
+            output_names=output_names,
+            dynamic_axes=dynamic_axes,
+            opset_version=OPSET_VERSION,
+            **kwargs,
+        )
+    os.replace(tmp, path)
+    return path
+
+
+def export_classifier(model, path, channels=3, size=(512, 512)):
+    """
+    Exports `model.predict` to ONNX with dynamic batch, height and width, so
+    one graph serves every batch size and aspect bucket. The model itself is
+    left as it is, a BatchNorm-folded copy is traced.
+    """
+    # folded before tracing: the exporter's own conv + BN fusion folds a BN
+    # once per call, and predict() runs the attention map once per class
+    model = copy.deepcopy(model).cpu().eval()
+    fold_bn_classifier(model)
+    # a batch of 2, a batch of 1 may be traced as a constant
+    example = torch.zeros((2, channels) + tuple(size))
+    return export(
+        ClassifierLogits(model),
+        example,
+        path,
+        ["logits"],
+        {"images": {0: "batch", 2: "height", 3: "width"}, "logits": {0: "batch"}},
+    )
+
+
+def export_visual_extractor(visual_extractor, path, channels=3):
+    """
+    Exports the ResNet trunk of the report model's visual extractor, images
+    to the (N, C, 7, 7) patch features, with a dynamic batch axis. Pooling
+    and reshaping the features stays in VisualExtractor.forward.
+    """
+    trunk = copy.deepcopy(visual_extractor.model).cpu().eval()
+    fold_bn(trunk)
+    example = torch.zeros((2, channels) + REPORT_SIZE)
+    return export(
+        trunk,
+        example,
+        path,
+        ["patch_feats"],
+        {"images": {0: "batch"}, "patch_feats": {0: "batch"}},
+    )
+
+
+def main():
+    from diagnosis_module.cxr.diagnosis import cxr_init
+    from r2g.mrg_main import MRG
+    from r2g.report_generate import report_gen_cfg
+
+    parser = argparse.ArgumentParser(
+        description="export the classifier and the report model's visual "
+        "extractor to ONNX with a dynamic batch axis"
+    )
+    parser.add_argument("--out-dir", default=MRG.onnx_dir)
+    parser.add_argument(
+        "--single-channel",
+        action="store_true",
+        help="export the folded 1-channel stems (MRG_SINGLE_CHANNEL)",
+    )
+    args = parser.parse_args()
+
+    img_model, img_cfg = cxr_init(MRG.img_cfg_path, MRG.img_weight_path)
+    visual_extractor = report_gen_cfg().model.visual_extractor
+    channels = 3
+    if args.single_channel:
+        single_channel_classifier(img_model)
+        single_channel_visual_extractor(visual_extractor, REPORT_MEAN, REPORT_STD)
+        channels = 1
+    for path in (
+        export_classifier(
+            img_model,
+            os.path.join(args.out_dir, "classifier.onnx"),
+            channels,
+            (img_cfg.long_side, img_cfg.long_side),
+        ),
+        export_visual_extractor(
+            visual_extractor,
+            os.path.join(args.out_dir, "visual_extractor.onnx"),
+            channels,
+        ),
+    ):
+        print(f"{path} ({os.path.getsize(path) >> 20} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import torch
+import torch.nn as nn
+
+
+class OrtModule(nn.Module):
+    """
+    Stands in for the torch module an ONNX graph was exported from and runs
+    the graph with ONNX Runtime's CPU provider: a float32 batch in, copied to
+    the host if needed, and the graph's outputs back as CPU tensors.
+    """
+
+    def __init__(self, path, num_threads=0):
+        super(OrtModule, self).__init__()
+        # onnxruntime is only imported when the onnx backend is selected
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        # idle pool threads sleep instead of spinning: the other model's
+        # branch may be running on the same cores
+        options.add_session_config_entry("session.intra_op.allow_spinning", "0")
+        self.path = path
+        self.session = ort.InferenceSession(
+            path, options, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def forward(self, images):
+        images = images.detach().to("cpu", torch.float32).contiguous().numpy()
+        outputs = self.session.run(None, {self.input_name: images})
+        outputs = [torch.from_numpy(output) for output in outputs]
+        return outputs[0] if len(outputs) == 1 else tuple(outputs)
+
+
+class OrtClassifier(OrtModule):
+    # cxr_infer only calls predict(), which is what export_classifier traced
+    def predict(self, images):
+        return self(images)
@@ -0,0 +1,119 @@
+import torch
+import torch.nn as nn
+
+from optimize.single_channel import GrayConv
+
+# modules whose forward applies the bn right after the conv, by attribute
+CONV_BN_PAIRS = {
+    "torchvision.models.resnet.BasicBlock": (("conv1", "bn1"), ("conv2", "bn2")),
+    "torchvision.models.resnet.Bottleneck": (
+        ("conv1", "bn1"),
+        ("conv2", "bn2"),
+        ("conv3", "bn3"),
+    ),
+    "torchvision.models.resnet.ResNet": (("conv1", "bn1"),),
+}
+
+
+def bn_scale_shift(bn):
+    # eval-mode BatchNorm2d as y = x * scale + shift, computed in float64
+    var = bn.running_var.double()
+    scale = torch.rsqrt(var + bn.eps)
+    if bn.weight is not None:
+        scale = scale * bn.weight.double()
+    shift = -bn.running_mean.double() * scale
+    if bn.bias is not None:
+        shift = shift + bn.bias.double()
+    return scale, shift
+
+
+def foldable(conv, bn):
+    return (
+        isinstance(conv, (nn.Conv2d, GrayConv))
+        and type(bn) is nn.BatchNorm2d
+        and bn.track_running_stats
+        and bn.running_mean is not None
+    )
+
+
+def fold_conv_bn(conv, bn):
+    # the bn applied to every output channel of the conv is a per-channel
+    # affine map, so it moves into the conv's weight and bias exactly
+    scale, shift = bn_scale_shift(bn)
+    weight = conv.weight.double() * scale.view(-1, 1, 1, 1)
+    bias = shift
+    if conv.bias is not None:
+        bias = bias + conv.bias.double() * scale
+    dtype = conv.weight.dtype
+    conv.weight = nn.Parameter(weight.to(dtype), requires_grad=False)
+    conv.bias = nn.Parameter(bias.to(dtype), requires_grad=False)
+    if isinstance(conv, GrayConv) and conv.offset is not None:
+        offset = conv.offset.double() * scale.view(-1, 1, 1, 1)
+        conv.offset = nn.Parameter(offset.to(dtype), requires_grad=False)
+        conv._border_bias.clear()
+
+
+class ScaleShift(nn.Module):
+    """
+    An eval-mode BatchNorm2d that has no conv right before it to fold into,
+    e.g. DenseNet's pre-activation norms over concatenated features: one
+    multiply-add per element with precomputed per-channel constants.
+    """
+
+    def __init__(self, bn):
+        super(ScaleShift, self).__init__()
+        scale, shift = bn_scale_shift(bn)
+        dtype = bn.running_mean.dtype
+        self.register_buffer("scale", scale.to(dtype).view(-1, 1, 1))
+        self.register_buffer("shift", shift.to(dtype).view(-1, 1, 1))
+
+    def forward(self, x):
+        return torch.addcmul(self.shift, x, self.scale)
+
+
+def conv_bn_pairs(parent):
+    # (conv, bn) attribute names of parent where the bn directly follows the conv
+    if isinstance(parent, nn.Sequential):
+        names = list(parent._modules)
+        return list(zip(names, names[1:]))
+    cls = type(parent)
+    return CONV_BN_PAIRS.get(f"{cls.__module__}.{cls.__qualname__}", ())
+
+
+def fold_bn(module):
+    """
+    Inference-only pass over `module`, in place: every frozen BatchNorm2d
+    that directly follows a convolution is folded into that convolution's
+    weights and replaced by nn.Identity, every other one by a ScaleShift.
+    Returns the number of norms folded and converted.
+    """
+    module.eval()
+    folded = converted = 0
+    with torch.no_grad():
+        for parent in list(module.modules()):
+            for conv_name, bn_name in conv_bn_pairs(parent):
+                conv, bn = parent._modules[conv_name], parent._modules[bn_name]
+                if foldable(conv, bn):
+                    fold_conv_bn(conv, bn)
+                    parent._modules[bn_name] = nn.Identity()
+                    folded += 1
+
+        for parent in list(module.modules()):
+            for name, child in list(parent._modules.items()):
+                if type(child) is nn.BatchNorm2d and child.running_mean is not None:
+                    parent._modules[name] = ScaleShift(child)
+                    converted += 1
+    return folded, converted
+
+
+def fold_bn_classifier(model):
+    # backbone and attention map only: the per-class bn_i heads are already
+    # fused by Classifier.predict, which reads their running statistics
+    return tuple(
+        sum(counts)
+        for counts in zip(fold_bn(model.backbone), fold_bn(model.attention_map))
+    )
+
+
+def fold_bn_visual_extractor(visual_extractor):
+    return fold_bn(visual_extractor.model)
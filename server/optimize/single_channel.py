@@ -0,0 +1,71 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+def fold_gray_conv(conv, mean=None, std=None):
+    """
+    A 1-input-channel replacement for `conv` when all of its input channels
+    carry the same grey image. With mean/std the per-channel normalisation
+    (x - mean[c]) / std[c] of that image is folded in as well, so the new conv
+    takes the unnormalised grey image.
+    """
+    weight = conv.weight.detach()
+    if mean is None:
+        return GrayConv(conv, weight.sum(dim=1, keepdim=True))
+    std = torch.as_tensor(std, dtype=weight.dtype, device=weight.device)
+    mean = torch.as_tensor(mean, dtype=weight.dtype, device=weight.device)
+    scaled = weight / std[None, :, None, None]
+    # the normalised image is zero-padded, so the mean only contributes
+    # through the taps that fall inside the image: see GrayConv.border_bias
+    offset = (scaled * mean[None, :, None, None]).sum(dim=1, keepdim=True)
+    return GrayConv(conv, scaled.sum(dim=1, keepdim=True), offset)
+
+
+class GrayConv(nn.Module):
+    def __init__(self, conv, weight, offset=None):
+        super(GrayConv, self).__init__()
+        self.stride = conv.stride
+        self.padding = conv.padding
+        self.dilation = conv.dilation
+        self.weight = nn.Parameter(weight, requires_grad=False)
+        self.bias = conv.bias
+        if offset is not None:
+            offset = nn.Parameter(offset, requires_grad=False)
+        self.offset = offset
+        # per input size, built on first use
+        self._border_bias = {}
+
+    def conv(self, x, weight, bias=None):
+        return F.conv2d(x, weight, bias, self.stride, self.padding, self.dilation)
+
+    def border_bias(self, x):
+        # -sum(w * mean / std) over the taps of each output position that
+        # fall inside the image, i.e. the folded mean of the zero-padded input
+        key = (x.shape[-2:], x.device, x.dtype)
+        if key not in self._border_bias:
+            ones = torch.ones((1, 1) + x.shape[-2:], device=x.device, dtype=x.dtype)
+            with torch.no_grad():
+                self._border_bias[key] = -self.conv(ones, self.offset)
+        return self._border_bias[key]
+
+    def forward(self, x):
+        out = self.conv(x, self.weight, self.bias)
+        if self.offset is not None:
+            out = out + self.border_bias(x)
+        return out
+
+
+def single_channel_classifier(model):
+    # the classifier input is the normalised grey image repeated three times
+    features = model.backbone.features
+    features.conv0 = fold_gray_conv(features.conv0)
+    return model
+
+
+def single_channel_visual_extractor(visual_extractor, mean, std):
+    # the report model normalises every channel with its own mean/std, the
+    # grey image comes in as ToTensor left it
+    stem = visual_extractor.model
+    stem[0] = fold_gray_conv(stem[0], mean, std)
+    return visual_extractor
@@ -0,0 +1,56 @@
+import os
+
+import torch
+
+from serving.native import NativeWorkers
+
+
+def parse_cpus(spec):
+    # "0-3,8,10-11" -> {0, 1, 2, 3, 8, 10, 11}; empty means no pinning
+    cpus = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+class Branch:
+    """
+    One model branch of the pipeline-parallel mode: a dedicated native thread
+    that runs the calls submitted to it in order, with its own intra-op thread
+    budget and optionally pinned to a set of CPUs (e.g. one NUMA node).
+    Without an explicit budget a branch gets one thread per pinned CPU, or its
+    1/`parts` share of torch's threads.
+    """
+
+    def __init__(self, name, num_threads=0, cpus=None, parts=2):
+        self.name = name
+        self.num_threads = num_threads
+        self.cpus = cpus
+        self.parts = parts
+        self._worker = NativeWorkers(f"mrg-{name}", setup=self._setup)
+
+    def threads(self):
+        # the intra-op thread budget this branch runs its calls with
+        if self.num_threads > 0:
+            return self.num_threads
+        if self.cpus:
+            return len(self.cpus)
+        return max(1, torch.get_num_threads() // self.parts)
+
+    def _setup(self):
+        num_threads = self.threads()
+        if self.cpus:
+            # pid 0 is the calling thread
+            os.sched_setaffinity(0, self.cpus)
+        # per thread with OpenMP, so each branch keeps its own share. A
+        # thread's pool is set up lazily from whatever count some thread set
+        # last, get_num_threads() sets it up now so ours is not overwritten
+        torch.get_num_threads()
+        torch.set_num_threads(num_threads)
+
+    def submit(self, fn, *args, **kwargs):
+        return self._worker.submit(fn, *args, **kwargs)
@@ -0,0 +1,23 @@
+import argparse
+
+from r2g.mgr_backbone.tokenizers import Tokenizer
+from r2g.report_generate import REPORT_GEN_CFG
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="precompile the report tokenizer vocabulary from annotation.json"
+    )
+    parser.add_argument("--ann", default=REPORT_GEN_CFG["ann_path"])
+    parser.add_argument("--out", default=REPORT_GEN_CFG["vocab_path"])
+    parser.add_argument("--threshold", type=int, default=REPORT_GEN_CFG["threshold"])
+    args = parser.parse_args()
+
+    # no vocab_path, so the vocabulary is built from the annotations
+    tokenizer = Tokenizer({"ann_path": args.ann, "threshold": args.threshold})
+    tokenizer.save_vocabulary(args.out)
+    print(f"{args.ann} -> {args.out}: {tokenizer.get_vocab_size()} tokens")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,8 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+from contextlib import nullcontext
+
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -126,11 +128,13 @@ class AttModel(CaptionModel):
         assert (
             sample_n == 1 or sample_n == beam_size // group_size
         ), "when beam search, sample_n == 1 or beam search"
+        timer = opt.get("stage_timer", nullcontext)
         batch_size = fc_feats.size(0)
 
-        p_fc_feats, p_att_feats, pp_att_feats, p_att_masks = self._prepare_feature(
-            fc_feats, att_feats, att_masks
-        )
+        with timer("encoder"):
+            p_fc_feats, p_att_feats, pp_att_feats, p_att_masks = self._prepare_feature(
+                fc_feats, att_feats, att_masks
+            )
 
         assert (
             beam_size <= self.vocab_size + 1
@@ -147,38 +151,48 @@ class AttModel(CaptionModel):
 
         state = self.init_hidden(batch_size)
 
-        # first step, feed bos
-        it = fc_feats.new_full([batch_size], self.bos_idx, dtype=torch.long)
-        logprobs, state = self.get_logprobs_state(
-            it, p_fc_feats, p_att_feats, pp_att_feats, p_att_masks, state
-        )
+        with timer("beam_search"):
+            # first step, feed bos
+            it = fc_feats.new_full([batch_size], self.bos_idx, dtype=torch.long)
+            logprobs, state = self.get_logprobs_state(
+                it, p_fc_feats, p_att_feats, pp_att_feats, p_att_masks, state
+            )
 
-        p_fc_feats, p_att_feats, pp_att_feats, p_att_masks = utils.repeat_tensors(
-            beam_size, [p_fc_feats, p_att_feats, pp_att_feats, p_att_masks]
-        )
-        self.done_beams = self.beam_search(
-            state, logprobs, p_fc_feats, p_att_feats, pp_att_feats, p_att_masks, opt=opt
-        )
+            p_fc_feats, p_att_feats, pp_att_feats, p_att_masks = utils.repeat_tensors(
+                beam_size, [p_fc_feats, p_att_feats, pp_att_feats, p_att_masks]
+            )
+            # kept local: the same model may be decoding on several threads
+            done_beams = self.beam_search(
+                state,
+                logprobs,
+                p_fc_feats,
+                p_att_feats,
+                pp_att_feats,
+                p_att_masks,
+                opt=opt,
+            )
+        self.done_beams = done_beams
         for k in range(batch_size):
             if sample_n == beam_size:
                 for _n in range(sample_n):
-                    seq_len = self.done_beams[k][_n]["seq"].shape[0]
-                    seq[k * sample_n + _n, :seq_len] = self.done_beams[k][_n]["seq"]
-                    seqLogprobs[k * sample_n + _n, :seq_len] = self.done_beams[k][_n][
+                    seq_len = done_beams[k][_n]["seq"].shape[0]
+                    seq[k * sample_n + _n, :seq_len] = done_beams[k][_n]["seq"]
+                    seqLogprobs[k * sample_n + _n, :seq_len] = done_beams[k][_n][
                         "logps"
                     ]
             else:
-                seq_len = self.done_beams[k][0]["seq"].shape[0]
-                seq[k, :seq_len] = self.done_beams[k][0][
+                seq_len = done_beams[k][0]["seq"].shape[0]
+                seq[k, :seq_len] = done_beams[k][0][
                     "seq"
                 ]  # the first beam has highest cumulative score
-                seqLogprobs[k, :seq_len] = self.done_beams[k][0]["logps"]
+                seqLogprobs[k, :seq_len] = done_beams[k][0]["logps"]
         # return the samples and their log likelihoods
         return seq, seqLogprobs
 
     def _sample(self, fc_feats, att_feats, att_masks=None, update_opts={}):
         # opt = self.args.__dict__
-        opt = self.args
+        # copied so per-call options never leak into the shared model config
+        opt = dict(self.args)
         opt.update(**update_opts)
 
         sample_method = opt.get("sample_method", "greedy")
@@ -189,6 +203,9 @@ class AttModel(CaptionModel):
         output_logsoftmax = opt.get("output_logsoftmax", 1)
         decoding_constraint = opt.get("decoding_constraint", 0)
         block_trigrams = opt.get("block_trigrams", 0)
+        # called with (image index, partial seq) after every decoding step
+        progress_callback = opt.get("progress_callback")
+        timer = opt.get("stage_timer", nullcontext)
         if beam_size > 1 and sample_method in ["greedy", "beam_search"]:
             return self._sample_beam(fc_feats, att_feats, att_masks, opt)
         if group_size > 1:
@@ -197,9 +214,10 @@ class AttModel(CaptionModel):
         batch_size = fc_feats.size(0)
         state = self.init_hidden(batch_size * sample_n)
 
-        p_fc_feats, p_att_feats, pp_att_feats, p_att_masks = self._prepare_feature(
-            fc_feats, att_feats, att_masks
-        )
+        with timer("encoder"):
+            p_fc_feats, p_att_feats, pp_att_feats, p_att_masks = self._prepare_feature(
+                fc_feats, att_feats, att_masks
+            )
 
         if sample_n > 1:
             p_fc_feats, p_att_feats, pp_att_feats, p_att_masks = utils.repeat_tensors(
@@ -214,88 +232,93 @@ class AttModel(CaptionModel):
         seqLogprobs = fc_feats.new_zeros(
             batch_size * sample_n, self.max_seq_length, self.vocab_size + 1
         )
-        for t in range(self.max_seq_length + 1):
-            if t == 0:  # input <bos>
-                it = fc_feats.new_full(
-                    [batch_size * sample_n], self.bos_idx, dtype=torch.long
-                )
+        with timer("greedy_search"):
+            for t in range(self.max_seq_length + 1):
+                if t == 0:  # input <bos>
+                    it = fc_feats.new_full(
+                        [batch_size * sample_n], self.bos_idx, dtype=torch.long
+                    )
 
-            logprobs, state = self.get_logprobs_state(
-                it,
-                p_fc_feats,
-                p_att_feats,
-                pp_att_feats,
-                p_att_masks,
-                state,
-                output_logsoftmax=output_logsoftmax,
-            )
+                logprobs, state = self.get_logprobs_state(
+                    it,
+                    p_fc_feats,
+                    p_att_feats,
+                    pp_att_feats,
+                    p_att_masks,
+                    state,
+                    output_logsoftmax=output_logsoftmax,
+                )
 
-            if decoding_constraint and t > 0:
-                tmp = logprobs.new_zeros(logprobs.size())
-                tmp.scatter_(1, seq[:, t - 1].data.unsqueeze(1), float("-inf"))
-                logprobs = logprobs + tmp
-
-            # Mess with trigrams
-            # Copy from https://github.com/lukemelas/image-paragraph-captioning
-            if block_trigrams and t >= 3:
-                # Store trigram generated at last step
-                prev_two_batch = seq[:, t - 3 : t - 1]
-                for i in range(batch_size):  # = seq.size(0)
-                    prev_two = (
-                        prev_two_batch[i][0].item(),
-                        prev_two_batch[i][1].item(),
-                    )
-                    current = seq[i][t - 1]
-                    if t == 3:  # initialize
-                        trigrams.append(
-                            {prev_two: [current]}
-                        )  # {LongTensor: list containing 1 int}
-                    elif t > 3:
-                        if prev_two in trigrams[i]:  # add to list
-                            trigrams[i][prev_two].append(current)
-                        else:  # create list
-                            trigrams[i][prev_two] = [current]
-                # Block used trigrams at next step
-                prev_two_batch = seq[:, t - 2 : t]
-                mask = torch.zeros(
-                    logprobs.size(), requires_grad=False
-                ).cuda()  # batch_size x vocab_size
-                for i in range(batch_size):
-                    prev_two = (
-                        prev_two_batch[i][0].item(),
-                        prev_two_batch[i][1].item(),
-                    )
-                    if prev_two in trigrams[i]:
-                        for j in trigrams[i][prev_two]:
-                            mask[i, j] += 1
-                # Apply mask to log probs
-                # logprobs = logprobs - (mask * 1e9)
-                alpha = 2.0  # = 4
-                logprobs = logprobs + (
-                    mask * -0.693 * alpha
-                )  # ln(1/2) * alpha (alpha -> infty works best)
-
-            # sample the next word
-            if t == self.max_seq_length:  # skip if we achieve maximum length
-                break
-            it, sampleLogprobs = self.sample_next_word(
-                logprobs, sample_method, temperature
-            )
+                if decoding_constraint and t > 0:
+                    tmp = logprobs.new_zeros(logprobs.size())
+                    tmp.scatter_(1, seq[:, t - 1].data.unsqueeze(1), float("-inf"))
+                    logprobs = logprobs + tmp
+
+                # Mess with trigrams
+                # Copy from https://github.com/lukemelas/image-paragraph-captioning
+                if block_trigrams and t >= 3:
+                    # Store trigram generated at last step
+                    prev_two_batch = seq[:, t - 3 : t - 1]
+                    for i in range(batch_size):  # = seq.size(0)
+                        prev_two = (
+                            prev_two_batch[i][0].item(),
+                            prev_two_batch[i][1].item(),
+                        )
+                        current = seq[i][t - 1]
+                        if t == 3:  # initialize
+                            trigrams.append(
+                                {prev_two: [current]}
+                            )  # {LongTensor: list containing 1 int}
+                        elif t > 3:
+                            if prev_two in trigrams[i]:  # add to list
+                                trigrams[i][prev_two].append(current)
+                            else:  # create list
+                                trigrams[i][prev_two] = [current]
+                    # Block used trigrams at next step
+                    prev_two_batch = seq[:, t - 2 : t]
+                    mask = torch.zeros(
+                        logprobs.size(), requires_grad=False, device=logprobs.device
+                    )  # batch_size x vocab_size
+                    for i in range(batch_size):
+                        prev_two = (
+                            prev_two_batch[i][0].item(),
+                            prev_two_batch[i][1].item(),
+                        )
+                        if prev_two in trigrams[i]:
+                            for j in trigrams[i][prev_two]:
+                                mask[i, j] += 1
+                    # Apply mask to log probs
+                    # logprobs = logprobs - (mask * 1e9)
+                    alpha = 2.0  # = 4
+                    logprobs = logprobs + (
+                        mask * -0.693 * alpha
+                    )  # ln(1/2) * alpha (alpha -> infty works best)
+
+                # sample the next word
+                if t == self.max_seq_length:  # skip if we achieve maximum length
+                    break
+                it, sampleLogprobs = self.sample_next_word(
+                    logprobs, sample_method, temperature
+                )
 
-            # stop when all finished
-            if t == 0:
-                unfinished = it != self.eos_idx
-            else:
-                it[~unfinished] = (
-                    self.pad_idx
-                )  # This allows eos_idx not being overwritten to 0
-                logprobs = logprobs * unfinished.unsqueeze(1).float()
-                unfinished = unfinished * (it != self.eos_idx)
-            seq[:, t] = it
-            seqLogprobs[:, t] = logprobs
-            # quit loop if all sequences have finished
-            if unfinished.sum() == 0:
-                break
+                # stop when all finished
+                if t == 0:
+                    unfinished = it != self.eos_idx
+                else:
+                    it[~unfinished] = (
+                        self.pad_idx
+                    )  # This allows eos_idx not being overwritten to 0
+                    logprobs = logprobs * unfinished.unsqueeze(1).float()
+                    unfinished = unfinished * (it != self.eos_idx)
+                seq[:, t] = it
+                seqLogprobs[:, t] = logprobs
+                if progress_callback is not None:
+                    for k in range(seq.size(0)):
+                        if unfinished[k]:
+                            progress_callback(k, seq[k, : t + 1])
+                # quit loop if all sequences have finished
+                if unfinished.sum() == 0:
+                    break
 
         return seq, seqLogprobs
 
@@ -155,10 +155,13 @@ class CaptionModel(nn.Module):
         decoding_constraint = opt.get("decoding_constraint", 0)
         suppress_UNK = opt.get("suppress_UNK", 0)
         length_penalty = utils.penalty_builder(opt.get("length_penalty", ""))
+        # called with (image index, seq) whenever an image gets a better finished beam
+        progress_callback = opt.get("progress_callback")
         bdash = beam_size // group_size  # beam per group
 
         batch_size = init_logprobs.shape[0]
         device = init_logprobs.device
+        best_done_p = [float("-inf")] * batch_size
         # INITIALIZATIONS
         beam_seq_table = [
             torch.LongTensor(batch_size, bdash, 0).to(device) for _ in range(group_size)
@@ -263,13 +266,19 @@ class CaptionModel(nn.Module):
                                     t - divm + 1, final_beam["p"]
                                 )
                                 done_beams_table[b][divm].append(final_beam)
+                                if (
+                                    progress_callback is not None
+                                    and final_beam["p"] > best_done_p[b]
+                                ):
+                                    best_done_p[b] = final_beam["p"]
+                                    progress_callback(b, final_beam["seq"])
                         beam_logprobs_sum_table[divm][b, is_end] -= 1000
 
                     # move the current group one step forward in time
 
                     it = beam_seq_table[divm][:, :, t - divm].reshape(-1)
                     logprobs_table[divm], state_table[divm] = self.get_logprobs_state(
-                        it.cuda(), *(args[divm] + [state_table[divm]])
+                        it.to(device), *(args[divm] + [state_table[divm]])
                     )
                     logprobs_table[divm] = F.log_softmax(
                         logprobs_table[divm] / temperature, dim=-1
@@ -1,7 +1,11 @@
 import logging
 from abc import abstractmethod
+from contextlib import nullcontext
+
 import torch
 
+from model_io.loader import load_weights, resolve_weights
+
 
 class BaseGenerator(object):
     def __init__(self, model, criterion, metric_ftns, args):
@@ -63,20 +67,24 @@ class BaseGenerator(object):
 
 class Generator:
     def __init__(self, cfg, model):
+        # model may live on the meta device, it is materialised from the
+        # checkpoint before being moved to the configured device
+        self.cfg = cfg
         self.device, device_ids = self._prepare_device(cfg["n_gpu"])
-        self.model = model.to(self.device)
+        self.model = model
         self._load_checkpoint(cfg["load"])
+        self.model = self.model.to(self.device)
 
     def _prepare_device(self, n_gpu_use):
         n_gpu = torch.cuda.device_count()
         if n_gpu_use > 0 and n_gpu == 0:
-            self.logger.warning(
+            print(
                 "Warning: There's no GPU available on this machine,"
-                "training will be performed on CPU."
+                "inference will be performed on CPU."
             )
             n_gpu_use = 0
         if n_gpu_use > n_gpu:
-            self.logger.warning(
+            print(
                 "Warning: The number of GPU's configured to use is {}, but only {} are available "
                 "on this machine.".format(n_gpu_use, n_gpu)
             )
@@ -88,13 +96,21 @@ class Generator:
     def _load_checkpoint(self, load_path):
         load_path = str(load_path)
         # self.logger.info("Loading checkpoint: {} ...".format(load_path))
-        checkpoint = torch.load(load_path)
-        self.model.load_state_dict(checkpoint["state_dict"])
-
-    def report(self, img):
+        state_dict = load_weights(resolve_weights(load_path))
+        self.model.load_state_dict(state_dict, assign=True)
+
+    def report(self, img, progress=None, timer=nullcontext):
+        # progress, if given, is called with (image index, partial report)
+        # while decoding is still running. timer(stage) wraps each stage of
+        # the forward pass, e.g. to record its latency
+        update_opts = {"stage_timer": timer}
+        if progress is not None:
+            update_opts["progress_callback"] = lambda k, seq: progress(
+                k, self.model.tokenizer.decode(seq.tolist())
+            )
         self.model.eval()
         with torch.no_grad():
             img = img.to(self.device)
-            output, _ = self.model(img, mode="sample")
+            output, _ = self.model(img, mode="sample", update_opts=update_opts)
             report = self.model.tokenizer.decode_batch(output.cpu().numpy())
         return report
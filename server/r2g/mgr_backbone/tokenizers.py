@@ -1,37 +1,122 @@
 import json
+import os
 import re
 from collections import Counter
 
+# bump whenever the artifact layout or the report cleaning changes
+VOCAB_FORMAT = "r2g-vocab"
+VOCAB_VERSION = 1
+
+_WHITESPACE = re.compile(r"\s*")
+
+
+def iter_json_array(path, key, chunk_size=1 << 20):
+    """
+    Yields the items of the top-level array `key` of a JSON object file one
+    at a time, reading the file in chunks, so the whole document never sits
+    in memory.
+    """
+    decoder = json.JSONDecoder()
+    start = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+    with open(path, "r") as f:
+        buf, pos = "", None
+        # find the opening bracket of the array
+        while pos is None:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                raise KeyError(f"{key} not found in {path}")
+            # keep a tail in case the key is split across two chunks
+            buf = buf[-len(key) - 64 :] + chunk
+            match = start.search(buf)
+            if match:
+                buf, pos = buf[match.end() :], 0
+
+        eof = False
+        while True:
+            pos = _WHITESPACE.match(buf, pos).end()
+            if pos < len(buf) and buf[pos] == "]":
+                return
+            if pos < len(buf) and buf[pos] == ",":
+                pos += 1
+                continue
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # the item is cut off at the end of the buffer, read on
+                if eof:
+                    raise
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buf, pos = buf[pos:] + chunk, 0
+                continue
+            yield item
+            pos = end
+
 
 class Tokenizer(object):
     def __init__(self, cfg):
         self.ann_path = cfg["ann_path"]
+        # precompiled vocabulary, built from ann_path when missing
+        self.vocab_path = cfg.get("vocab_path")
         self.threshold = cfg["threshold"]
         # self.dataset_name = args.dataset_name
         # if self.dataset_name == 'iu_xray':
         #     self.clean_report = self.clean_report_iu_xray
         # else:
         self.clean_report = self.clean_report_mimic_cxr
-        self.ann = json.loads(open(self.ann_path, "r").read())
-        self.token2idx, self.idx2token = self.create_vocabulary()
+        if self.vocab_path and os.path.exists(self.vocab_path):
+            self.token2idx, self.idx2token = self.load_vocabulary(self.vocab_path)
+        else:
+            self.token2idx, self.idx2token = self.create_vocabulary()
 
     def create_vocabulary(self):
-        total_tokens = []
+        # streams the training reports, the annotation file is never kept
+        counter = Counter()
+        for example in iter_json_array(self.ann_path, "train"):
+            counter.update(self.clean_report(example["report"]).split())
 
-        for example in self.ann["train"]:
-            tokens = self.clean_report(example["report"]).split()
-            for token in tokens:
-                total_tokens.append(token)
-
-        counter = Counter(total_tokens)
         vocab = [k for k, v in counter.items() if v >= self.threshold] + ["<unk>"]
         vocab.sort()
+        return self._index_vocabulary(vocab)
+
+    def _index_vocabulary(self, vocab):
         token2idx, idx2token = {}, {}
         for idx, token in enumerate(vocab):
             token2idx[token] = idx + 1
             idx2token[idx + 1] = token
         return token2idx, idx2token
 
+    def load_vocabulary(self, path):
+        with open(path, "r") as f:
+            artifact = json.load(f)
+        if (
+            artifact.get("format") != VOCAB_FORMAT
+            or artifact.get("version") != VOCAB_VERSION
+        ):
+            raise ValueError(
+                f"{path} is not a {VOCAB_FORMAT} v{VOCAB_VERSION} vocabulary, rebuild it"
+            )
+        if artifact["threshold"] != self.threshold:
+            raise ValueError(
+                f"{path} was built with threshold {artifact['threshold']}, "
+                f"expected {self.threshold}, rebuild it"
+            )
+        return self._index_vocabulary(artifact["tokens"])
+
+    def save_vocabulary(self, path):
+        artifact = {
+            "format": VOCAB_FORMAT,
+            "version": VOCAB_VERSION,
+            "threshold": self.threshold,
+            "source": os.path.basename(self.ann_path),
+            # index i + 1 is tokens[i], 0 is reserved for bos/eos/pad
+            "tokens": [self.idx2token[idx] for idx in sorted(self.idx2token)],
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(artifact, f)
+        os.replace(tmp_path, path)
+
     def clean_report_iu_xray(self, report):
         report_cleaner = (
             lambda t: t.replace("..", ".")
@@ -1,5 +1,4 @@
 import numpy as np
-import cv2
 import torch
 
 
@@ -57,6 +56,8 @@ def repeat_tensors(n, x):
 
 
 def generate_heatmap(image, weights):
+    import cv2
+
     image = image.transpose(1, 2, 0)
     height, width, _ = image.shape
     weights = weights.reshape(
@@ -1,12 +1,15 @@
 import torch
 import torch.nn as nn
-import torchvision.models as models
 
 
 class VisualExtractor(nn.Module):
     def __init__(self, cfg):
         super(VisualExtractor, self).__init__()
         self.visual_extractor = cfg["visual_extractor"]
+        # torchvision (and everything it pulls in) is only imported when a
+        # report model is actually built
+        from torchvision import models
+
         model = getattr(models, self.visual_extractor)()
         modules = list(model.children())[:-2]
         self.model = nn.Sequential(*modules)
@@ -1,3 +1,5 @@
+from contextlib import nullcontext
+
 import numpy as np
 import torch
 import torch.nn as nn
@@ -40,7 +42,8 @@ class BaseCMNModel(nn.Module):
             raise ValueError
 
     def forward_mimic_cxr(self, images, targets=None, mode="train", update_opts={}):
-        att_feats, fc_feats = self.visual_extractor(images)
+        with update_opts.get("stage_timer", nullcontext)("visual_extractor"):
+            att_feats, fc_feats = self.visual_extractor(images)
         if mode == "train":
             output = self.encoder_decoder(fc_feats, att_feats, targets, mode="forward")
             return output
@@ -1,14 +1,144 @@
-from diagnosis_module.cxr.diagnosis import cxr_init, get_cxr_img, cxr_infer
+import glob
+import hashlib
+import itertools
+import json
+import os
+import time
+from contextlib import nullcontext
+
+import numpy as np
+import torch
+
+from diagnosis_module.cxr.diagnosis import cxr_init, get_cxr_imgs, cxr_infer
 from diagnosis_module.cxr.prompt import Prob2text
+from diagnosis_module.cxr.preprocess import REPORT_MEAN, REPORT_STD
+from diagnosis_module.cxr.utils import aspect_buckets
+from model_io.loader import is_file_backed, mapped_ranges, resolve_weights
+from model_io.onnx_export import export_classifier, export_visual_extractor
+from model_io.onnx_runtime import OrtClassifier, OrtModule
+from optimize.fold_bn import fold_bn_classifier, fold_bn_visual_extractor
+from optimize.single_channel import (
+    single_channel_classifier,
+    single_channel_visual_extractor,
+)
 from r2g.report_generate import report_gen_cfg
+from serving import native
+
+
+def prune_onnx(path):
+    # the other "<name>-<key>.onnx" graphs next to path; a session already
+    # open on one keeps working, it holds the graph in memory
+    name = os.path.basename(path).rsplit("-", 1)[0]
+    for stale in glob.glob(
+        os.path.join(glob.escape(os.path.dirname(path)), f"{name}-*.onnx")
+    ):
+        if stale != path:
+            try:
+                os.remove(stale)
+            except FileNotFoundError:
+                # another worker pruned it first
+                pass
+
+
+def share_weights(model):
+    # inference only: freeze the parameters and move every storage into shared
+    # memory, so processes forked after this map the same pages read-only
+    # instead of each holding (or copy-on-write duplicating) its own copy.
+    # Weights still mapped from a checkpoint file are shared through the page
+    # cache already, copying them to /dev/shm would only double them.
+    model.eval()
+    model.requires_grad_(False)
+    ranges = mapped_ranges()
+    for tensor in itertools.chain(model.parameters(), model.buffers()):
+        if not is_file_backed(tensor, ranges):
+            tensor.share_memory_()
+    return model
+
+
+def run_in_parallel(*fns):
+    # model loading is mostly file reads and tensor copies, which release the
+    # GIL, so the two models load side by side
+    results, errors = [None] * len(fns), []
+
+    def run(index, fn):
+        try:
+            results[index] = fn()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [
+        native.threading.Thread(target=run, args=(index, fn))
+        for index, fn in enumerate(fns)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
 
 
 class MRG:
-    def __init__(self):
-        self.img_model, self.img_cfg = cxr_init(
-            "./diagnosis_module/cxr/config/JF.json", "./weights/JFchexpert.pth"
+    img_cfg_path = "./diagnosis_module/cxr/config/JF.json"
+    img_weight_path = "./weights/JFchexpert.pth"
+    onnx_dir = "./weights/onnx"
+
+    def __init__(
+        self,
+        share_memory=False,
+        branches=None,
+        classifier_device="cpu",
+        batched_preprocess=False,
+        single_channel=False,
+        aspect_buckets=None,
+        fold_bn=False,
+        backend="torch",
+        onnx_dir=None,
+    ):
+        # branches, if given, is a (classifier, report) pair of Branch: the two
+        # models then run side by side on their own threads for every batch.
+        # batched_preprocess prepares each batch in torch on the classifier
+        # device instead of image by image with OpenCV. single_channel folds
+        # the grey-to-RGB replication (and the report model's normalisation)
+        # into the first conv of both models, which then take 1xHxW inputs.
+        # aspect_buckets, (height, width) pairs, lets the classifier take wide
+        # or tall images at the nearest bucket shape instead of a padded square.
+        # fold_bn folds the frozen BatchNorms into the convs before them and
+        # turns the rest into a single multiply-add. backend "onnx" runs the
+        # classifier and the report model's ResNet trunk with ONNX Runtime's
+        # CPU provider, with the graphs exported to onnx_dir, see use_onnx().
+        (self.img_model, self.img_cfg), self.reporter = run_in_parallel(
+            lambda: cxr_init(self.img_cfg_path, self.img_weight_path),
+            report_gen_cfg,
         )
-        self.reporter = report_gen_cfg()
+        if aspect_buckets:
+            self.img_cfg.aspect_buckets = [list(size) for size in aspect_buckets]
+        self.branches = branches
+        self.classifier_device = torch.device(classifier_device)
+        self.batched_preprocess = batched_preprocess
+        self.img_model = self.img_model.to(self.classifier_device)
+        self.single_channel = single_channel
+        if single_channel:
+            single_channel_classifier(self.img_model)
+            single_channel_visual_extractor(
+                self.reporter.model.visual_extractor, REPORT_MEAN, REPORT_STD
+            )
+        self.fold_bn = fold_bn
+        if fold_bn:
+            fold_bn_classifier(self.img_model)
+            fold_bn_visual_extractor(self.reporter.model.visual_extractor)
+        self.img_model.cache_heads()
+        if backend not in ("torch", "onnx"):
+            raise ValueError(f"unknown backend {backend!r}")
+        self.backend = backend
+        if onnx_dir:
+            self.onnx_dir = onnx_dir
+        if backend == "onnx":
+            self.use_onnx()
+        if share_memory:
+            share_weights(self.img_model)
+            share_weights(self.reporter.model)
         self.five_diseases = {
             "Cardiac hypertrophy": 0,
             "Pulmonary edema": 1,
@@ -34,17 +164,133 @@ class MRG:
             "Hernia": 13,
         }
 
-    def get_report(self, img_path):
+    def fingerprint(self):
+        # identifies the models and decoding settings a report was produced
+        # with, so cached reports are never served across a config change
+        weights = {}
+        for path in (self.img_weight_path, self.reporter.cfg["load"]):
+            path = resolve_weights(path)
+            stat = os.stat(path)
+            weights[path] = [stat.st_size, stat.st_mtime_ns]
+        state = {
+            "img_cfg": self.img_cfg,
+            "report_cfg": self.reporter.cfg,
+            # the batched resizes may differ from OpenCV/PIL by a grey level
+            "batched_preprocess": self.batched_preprocess,
+            "single_channel": self.single_channel,
+            "fold_bn": self.fold_bn,
+            "backend": self.backend,
+            "weights": weights,
+        }
+        state = json.dumps(state, sort_keys=True, default=str)
+        return hashlib.sha256(state.encode()).hexdigest()
+
+    def use_onnx(self):
+        # exports both CNNs as they are now (after any folding) unless this
+        # fingerprint's graphs are already on disk, then swaps in sessions.
+        # Graphs of other fingerprints (older weights or settings) are removed
+        # once this one's are in use.
+        key = self.fingerprint()[:16]
+        channels = 1 if self.single_channel else 3
+        classifier_threads = report_threads = torch.get_num_threads()
+        if self.branches is not None:
+            classifier_threads, report_threads = (b.threads() for b in self.branches)
+
+        path = os.path.join(self.onnx_dir, f"classifier-{key}.onnx")
+        if not os.path.exists(path):
+            long_side = self.img_cfg.long_side
+            export_classifier(self.img_model, path, channels, (long_side, long_side))
+        self.img_model = OrtClassifier(path, classifier_threads)
+        prune_onnx(path)
+
+        visual_extractor = self.reporter.model.visual_extractor
+        path = os.path.join(self.onnx_dir, f"visual_extractor-{key}.onnx")
+        if not os.path.exists(path):
+            export_visual_extractor(visual_extractor, path, channels)
+        visual_extractor.model = OrtModule(path, report_threads)
+        prune_onnx(path)
+
+    def warmup(self, batch_sizes=(1,), img_sizes=None):
+        # the first forward passes pay for allocator growth, kernel selection
+        # and first-touch page faults; run them on synthetic images instead of
+        # a real request, at every aspect bucket's shape by default. Returns
+        # the seconds spent.
+        start = time.perf_counter()
+        rng = np.random.default_rng(0)
+        for batch_size in batch_sizes:
+            for img_size in img_sizes or aspect_buckets(self.img_cfg):
+                imgs = [
+                    rng.integers(0, 256, img_size, dtype=np.uint8)
+                    for _ in range(batch_size)
+                ]
+                self.get_reports(imgs)
+        return time.perf_counter() - start
+
+    def grade(self, img2, progress=None, timer=nullcontext):
+        # Disease Classifier (jfchexpert) -> prob of what disease. Aspect
+        # bucketed batches come as (indices, tensor) groups, one forward each.
+        groups = img2 if isinstance(img2, list) else [(range(len(img2)), img2)]
+        with timer("classifier"):
+            probs = {}
+            for indices, batch in groups:
+                batch_probs = cxr_infer(
+                    self.img_model, batch.to(self.classifier_device), self.img_cfg
+                ).cpu()
+                probs.update(zip(indices, batch_probs))
+            probs = [probs[i] for i in range(len(probs))]
+        gradings = []
+        for i, prob in enumerate(probs):
+            with timer("prob2text"):
+                converter = Prob2text(prob, self.five_diseases)
+                gradings.append(converter.get_disease_probs_from_dict())
+            if progress is not None:
+                progress(i, "grading", gradings[i])
+        return gradings
+
+    def get_report(self, img):
+        return self.get_reports([img])[0]
+
+    def get_reports(self, imgs, progress=None, timer=nullcontext):
+        # one batched forward through both models for all images. Each image
+        # may be a file path, the encoded upload bytes or a decoded array.
+        # progress, if given, is called with (image index, kind, text): the
+        # disease grading as soon as the classifier is done ("grading"), then
+        # partial reports while decoding is still running ("partial").
+        # timer, if given, is entered around each stage with its name; stages
+        # cover the whole batch, not a single image.
+        with timer("get_cxr_img"):
+            img1, img2 = get_cxr_imgs(
+                imgs,
+                self.img_cfg,
+                timer,
+                batched=self.batched_preprocess,
+                device=self.classifier_device,
+                channels=1 if self.single_channel else 3,
+            )
+
         # Lesion Segmented (mimic_cxr) --> where is the disease
-        img1, img2 = get_cxr_img(img_path, self.img_cfg)
-        text_report = self.reporter.report(img1)[0]
+        report_progress = None
+        if progress is not None:
+            report_progress = lambda i, text: progress(i, "partial", text)
 
-        # Disease Classifier (jfchexpert) -> prob of what disease
-        prob = cxr_infer(self.img_model, img2, self.img_cfg)
-        converter = Prob2text(prob, self.five_diseases)
-        res = converter.get_disease_probs_from_dict()
+        if self.branches is None:
+            gradings = self.grade(img2, progress, timer)
+            text_reports = self.reporter.report(
+                img1, progress=report_progress, timer=timer
+            )
+        else:
+            # the models are independent until their outputs are merged below
+            classifier_branch, report_branch = self.branches
+            report_call = report_branch.submit(
+                self.reporter.report, img1, progress=report_progress, timer=timer
+            )
+            gradings = classifier_branch.submit(self.grade, img2, progress, timer)
+            gradings, text_reports = gradings.wait(), report_call.wait()
 
-        final_report = text_report + "\n" + res
-        print("prompt_report", final_report)
+        final_reports = []
+        for text_report, res in zip(text_reports, gradings):
+            final_report = text_report + "\n" + res
+            print("prompt_report", final_report)
+            final_reports.append(final_report)
 
-        return final_report
+        return final_reports
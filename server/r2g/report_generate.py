@@ -1,41 +1,50 @@
+import torch
+
 from r2g.models import BaseCMNModel
 from r2g.mgr_backbone.tokenizers import Tokenizer
 from r2g.mgr_backbone.generator import Generator
 
 
+REPORT_GEN_CFG = {
+    "visual_extractor": "resnet101",
+    "ann_path": "./r2g/annotation.json",
+    # built offline from ann_path with `python -m r2g.build_vocab`
+    "vocab_path": "./r2g/vocab.json",
+    "threshold": 10,
+    "cmm_dim": 512,
+    "cmm_size": 2048,
+    "logit_layers": 1,
+    "d_model": 512,
+    "d_ff": 512,
+    "d_vf": 2048,
+    "num_layers": 3,
+    "num_heads": 8,
+    "drop_prob_lm": 0.5,
+    "dropout": 0.1,
+    "max_seq_length": 100,
+    "bos_idx": 0,
+    "eos_idx": 0,
+    "pad_idx": 0,
+    "use_bn": 0,
+    "n_gpu": 1,
+    "topk": 32,
+    "sample_method": "beam_search",
+    "sample_n": 1,
+    "beam_size": 3,
+    "temperature": 1.0,
+    "load": "./weights/model_mimic_cxr.pth",
+    "group_size": 1,
+    "output_logsoftmax": 1,
+    "decoding_constraint": 0,
+    "block_trigrams": 1,
+}
+
+
 def report_gen_cfg():
-    cfg = {
-        "visual_extractor": "resnet101",
-        "ann_path": "./r2g/annotation.json",
-        "threshold": 10,
-        "cmm_dim": 512,
-        "cmm_size": 2048,
-        "logit_layers": 1,
-        "d_model": 512,
-        "d_ff": 512,
-        "d_vf": 2048,
-        "num_layers": 3,
-        "num_heads": 8,
-        "drop_prob_lm": 0.5,
-        "dropout": 0.1,
-        "max_seq_length": 100,
-        "bos_idx": 0,
-        "eos_idx": 0,
-        "pad_idx": 0,
-        "use_bn": 0,
-        "n_gpu": 1,
-        "topk": 32,
-        "sample_method": "beam_search",
-        "sample_n": 1,
-        "beam_size": 3,
-        "temperature": 1.0,
-        "load": "./weights/model_mimic_cxr.pth",
-        "group_size": 1,
-        "output_logsoftmax": 1,
-        "decoding_constraint": 0,
-        "block_trigrams": 1,
-    }
+    cfg = dict(REPORT_GEN_CFG)
     tokenizer = Tokenizer(cfg)
-    model = BaseCMNModel(cfg, tokenizer)
+    # skip the random init of every parameter, the checkpoint overwrites it
+    with torch.device("meta"):
+        model = BaseCMNModel(cfg, tokenizer)
     generator = Generator(cfg, model)
     return generator
@@ -0,0 +1,92 @@
+from collections import OrderedDict, defaultdict, deque
+
+from eventlet.queue import Empty
+from eventlet.semaphore import Semaphore
+
+
+class Rejected(Exception):
+    def __init__(self, reason):
+        super(Rejected, self).__init__(reason)
+        self.reason = reason
+
+
+class FairQueue:
+    """
+    Bounded request queue with one sub-queue per client. Items are handed out
+    round-robin across clients, so one client firing snips in a loop cannot
+    starve the others, and each client may only have `max_client_requests`
+    requests queued or in flight at once.
+    """
+
+    def __init__(self, cfg, metrics):
+        self.capacity = cfg["queue_depth"]
+        self.max_client_requests = cfg["max_client_requests"]
+        self.metrics = metrics
+        # client -> deque of items, in round-robin order
+        self._queues = OrderedDict()
+        # client -> requests queued or in flight
+        self._outstanding = defaultdict(int)
+        self._size = 0
+        self._available = Semaphore(0)
+
+        self.metrics.register_histogram(
+            "mrg_queue_depth_on_enqueue", (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+        )
+        self.metrics.set_gauge("mrg_queue_capacity", self.capacity)
+        self.metrics.set_gauge("mrg_max_client_requests", self.max_client_requests)
+
+    def qsize(self):
+        return self._size
+
+    def put(self, client, item):
+        if self._size >= self.capacity:
+            self.metrics.inc("mrg_rejected_queue_full_total")
+            raise Rejected("queue full")
+        if self._outstanding[client] >= self.max_client_requests:
+            self.metrics.inc("mrg_rejected_client_limit_total")
+            raise Rejected("too many requests in flight")
+
+        self._outstanding[client] += 1
+        self._queues.setdefault(client, deque()).append(item)
+        self._size += 1
+        self.metrics.observe("mrg_queue_depth_on_enqueue", self._size)
+        self.metrics.set_gauge("mrg_queue_depth", self._size)
+        self._available.release()
+
+    def _pop(self):
+        client, items = next(iter(self._queues.items()))
+        item = items.popleft()
+        if items:
+            # back of the line until every other client had its turn
+            self._queues.move_to_end(client)
+        else:
+            del self._queues[client]
+        self._size -= 1
+        self.metrics.set_gauge("mrg_queue_depth", self._size)
+        return item
+
+    def get(self, timeout=None):
+        if not self._available.acquire(timeout=timeout):
+            raise Empty
+        return self._pop()
+
+    def get_nowait(self):
+        if not self._available.acquire(blocking=False):
+            raise Empty
+        return self._pop()
+
+    def done(self, client):
+        # a request of `client` has left the system, finished or not
+        self._outstanding[client] -= 1
+        if self._outstanding[client] <= 0:
+            del self._outstanding[client]
+
+    def cancel(self, client):
+        # drop everything `client` still has queued, e.g. on disconnect
+        items = self._queues.pop(client, deque())
+        for _ in items:
+            self._available.acquire(blocking=False)
+            self._size -= 1
+            self.done(client)
+        self.metrics.set_gauge("mrg_queue_depth", self._size)
+        return list(items)
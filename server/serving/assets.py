@@ -0,0 +1,109 @@
+import hashlib
+import os
+import time
+
+import eventlet
+from eventlet.queue import Full, LightQueue
+
+
+class AssetStore:
+    """
+    Content-addressed archive of uploads. Each distinct file is stored once
+    under <root>/<aa>/<bb>/<sha256>.<ext>, written by a background writer, and
+    the store is trimmed to a size/age budget by a periodic sweep that evicts
+    the oldest files first.
+    """
+
+    def __init__(self, cfg, metrics, io):
+        self.root = cfg["assets_dir"]
+        self.max_bytes = cfg["assets_max_mb"] * 1024 * 1024
+        self.max_age = cfg["assets_max_age_days"] * 24 * 3600
+        self.sweep_interval = cfg["assets_sweep_s"]
+        self.metrics = metrics
+        # writes and sweeps run on the IOExecutor, the inference threads would
+        # otherwise stall behind a walk over the whole archive
+        self.io = io
+        # bounded so a slow disk can never pile uploads up in memory
+        self._queue = LightQueue(maxsize=cfg["assets_queue"])
+        self._writer = None
+
+    def start(self):
+        # spawned lazily so both loops belong to the hub of the serving process
+        if self._writer is None:
+            self._writer = eventlet.spawn(self._write_loop)
+            eventlet.spawn(self._sweep_loop)
+
+    def put(self, data, ext="png"):
+        self.start()
+        try:
+            self._queue.put_nowait((data, ext))
+        except Full:
+            self.metrics.inc("mrg_assets_dropped_total")
+
+    def _path(self, digest, ext):
+        return os.path.join(self.root, digest[:2], digest[2:4], f"{digest}.{ext}")
+
+    def _write(self, data, ext):
+        path = self._path(hashlib.sha256(data).hexdigest(), ext)
+        if os.path.exists(path):
+            # already archived, refresh it so retention counts from now
+            os.utime(path)
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return True
+
+    def _write_loop(self):
+        while True:
+            data, ext = self._queue.get()
+            try:
+                with self.metrics.stage_timer("disk_write"):
+                    written = self.io.execute(self._write, data, ext)
+                if written:
+                    self.metrics.inc("mrg_assets_written_total")
+                    self.metrics.inc("mrg_assets_written_bytes_total", len(data))
+                else:
+                    self.metrics.inc("mrg_assets_deduplicated_total")
+            except Exception as e:
+                print(f"Error archiving upload: {e}")
+
+    def _sweep(self):
+        files = []
+        for dir_path, _, file_names in os.walk(self.root):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        now = time.time()
+        evicted = 0
+        for mtime, size, path in files:
+            too_old = self.max_age > 0 and now - mtime > self.max_age
+            too_big = self.max_bytes > 0 and total > self.max_bytes
+            if not (too_old or too_big):
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+        return total, evicted
+
+    def _sweep_loop(self):
+        while True:
+            try:
+                total, evicted = self.io.execute(self._sweep)
+                self.metrics.set_gauge("mrg_assets_bytes", total)
+                self.metrics.inc("mrg_assets_evicted_total", evicted)
+            except Exception as e:
+                print(f"Error sweeping assets: {e}")
+            eventlet.sleep(self.sweep_interval)
@@ -0,0 +1,154 @@
+import time
+
+import eventlet
+from eventlet.event import Event
+from eventlet.queue import Empty
+
+from serving.admission import FairQueue, Rejected
+
+
+class _Pending:
+    __slots__ = ("item", "client", "on_progress", "event", "enqueued_at")
+
+    def __init__(self, item, client, on_progress=None):
+        self.item = item
+        self.client = client
+        self.on_progress = on_progress
+        self.event = Event()
+        self.enqueued_at = time.monotonic()
+
+
+class MicroBatcher:
+    """
+    Collects single-image requests into time/size bounded batches and runs
+    each batch through `infer_fn` on the inference executor. `infer_fn` takes
+    a list of items and returns a list of results in the same order.
+    """
+
+    def __init__(self, infer_fn, executor, cfg, metrics):
+        self.infer_fn = infer_fn
+        self.executor = executor
+        self.window = cfg["batch_window_ms"] / 1000.0
+        self.max_batch_size = cfg["max_batch_size"]
+        self.max_queue_wait = cfg["max_queue_wait_ms"] / 1000.0
+        self.metrics = metrics
+        self._queue = FairQueue(cfg, metrics)
+        self._loop = None
+        # requests in the batches being run right now
+        self._in_flight = 0
+
+        self.metrics.register_histogram("mrg_batch_size", (1, 2, 4, 8, 16, 32, 64))
+        self.metrics.set_gauge("mrg_batch_window_seconds", self.window)
+        self.metrics.set_gauge("mrg_max_batch_size", self.max_batch_size)
+        self.metrics.set_gauge("mrg_max_queue_wait_seconds", self.max_queue_wait)
+        self.metrics.set_gauge("mrg_inference_in_flight", 0)
+
+    def start(self):
+        # spawned lazily so the loop belongs to the hub of the serving process
+        if self._loop is None:
+            self._loop = eventlet.spawn(self._run)
+
+    def submit(self, item, client, on_progress=None):
+        """
+        Queue one item on behalf of `client`; `.wait()` on the returned event
+        yields its result. `on_progress` receives the progress events
+        `infer_fn` reports for this item, on a green thread. Raises Rejected
+        when the queue or the client's share of it is full.
+        """
+        self.start()
+        pending = _Pending(item, client, on_progress)
+        self._queue.put(client, pending)
+        return pending.event
+
+    def cancel(self, client):
+        # requests `client` still has queued are dropped, not run
+        for pending in self._queue.cancel(client):
+            pending.event.send_exception(Rejected("cancelled"))
+
+    def _collect(self):
+        first = self._queue.get()
+        batch = [first]
+        deadline = min(
+            time.monotonic() + self.window, first.enqueued_at + self.max_queue_wait
+        )
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    # window is closed, only take what is already waiting
+                    batch.append(self._queue.get_nowait())
+            except Empty:
+                break
+        return batch
+
+    def _dispatch(self, batch):
+        now = time.monotonic()
+        for pending in batch:
+            self.metrics.observe("mrg_queue_wait_seconds", now - pending.enqueued_at)
+        self.metrics.observe("mrg_batch_size", len(batch))
+        self.metrics.inc("mrg_batches_total")
+        self.metrics.inc("mrg_requests_total", len(batch))
+
+        if len(batch) == 1:
+            self._execute(batch)
+        elif not self._execute(batch, answer_errors=False):
+            # one bad item, e.g. an image the preprocessing cannot take, fails
+            # its whole batch: rerun the items alone so only its request fails
+            self.metrics.inc("mrg_batch_retries_total")
+            for pending in batch:
+                self._execute([pending])
+
+    def _execute(self, batch, answer_errors=True):
+        # runs the batch and answers its requests, False if it failed
+        def on_progress(index, *event):
+            if batch[index].on_progress is not None:
+                batch[index].on_progress(*event)
+
+        if not any(pending.on_progress for pending in batch):
+            on_progress = None
+
+        try:
+            results = self._run_batch(batch, on_progress)
+        except Exception as e:
+            self.metrics.inc("mrg_batch_errors_total")
+            if answer_errors:
+                for pending in batch:
+                    self._queue.done(pending.client)
+                    pending.event.send_exception(e)
+            return False
+
+        for pending, result in zip(batch, results):
+            self._queue.done(pending.client)
+            pending.event.send(result)
+        return True
+
+    def _run_batch(self, batch, on_progress):
+        self._in_flight += len(batch)
+        self.metrics.set_gauge("mrg_inference_in_flight", self._in_flight)
+        try:
+            return self.executor.execute(
+                self.infer_fn,
+                [pending.item for pending in batch],
+                on_progress=on_progress,
+            )
+        finally:
+            self._in_flight -= len(batch)
+            self.metrics.set_gauge("mrg_inference_in_flight", self._in_flight)
+
+    def _safe_dispatch(self, batch):
+        try:
+            self._dispatch(batch)
+        except Exception as e:
+            print(f"Error in mrg batcher: {e}")
+
+    def _run(self):
+        while True:
+            # only open a window once a worker can take the batch, so requests
+            # arriving while every worker is busy end up in the next batch
+            self.executor.wait_available()
+            batch = self._collect()
+            eventlet.spawn_n(self._safe_dispatch, batch)
+            # let the dispatch claim its worker before the next wait_available
+            eventlet.sleep(0)
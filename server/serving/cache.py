@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+import eventlet
+
+
+def image_key(img, fingerprint):
+    # keyed on the decoded pixels rather than the upload bytes, so the same
+    # radiograph re-encoded by a different snip still hits
+    h = hashlib.sha256()
+    h.update(fingerprint.encode())
+    h.update(f"{img.mode}:{img.size[0]}x{img.size[1]}".encode())
+    h.update(img.tobytes())
+    return h.hexdigest()
+
+
+class ReportCache:
+    """
+    Bounded in-memory LRU of finished reports, optionally backed by a
+    directory of json files that survives restarts.
+    """
+
+    def __init__(self, cfg, metrics, io):
+        self.max_items = cfg["cache_size"]
+        self.disk_dir = cfg["cache_dir"]
+        self.metrics = metrics
+        # disk reads and writes run on the IOExecutor, never on tpool
+        self.io = io
+        self._lru = OrderedDict()
+
+        self.metrics.set_gauge("mrg_cache_capacity", self.max_items)
+        self.metrics.set_gauge("mrg_cache_items", 0)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _read_disk(self, key):
+        try:
+            with open(self._disk_path(key), "r") as f:
+                return json.load(f)["report"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_disk(self, key, report):
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"report": report}, f)
+        os.replace(tmp_path, path)
+
+    def _store_disk(self, key, report):
+        try:
+            self.io.execute(self._write_disk, key, report)
+        except Exception as e:
+            print(f"Error writing report cache entry {key}: {e}")
+
+    def _remember(self, key, report):
+        if self.max_items <= 0:
+            # memory tier disabled
+            return
+        self._lru[key] = report
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_items:
+            self._lru.popitem(last=False)
+            self.metrics.inc("mrg_cache_evictions_total")
+        self.metrics.set_gauge("mrg_cache_items", len(self._lru))
+
+    def get(self, key):
+        if key in self._lru:
+            self._lru.move_to_end(key)
+            self.metrics.inc("mrg_cache_hits_total")
+            self.metrics.inc("mrg_cache_memory_hits_total")
+            return self._lru[key]
+
+        if self.disk_dir:
+            report = self.io.execute(self._read_disk, key)
+            if report is not None:
+                self._remember(key, report)
+                self.metrics.inc("mrg_cache_hits_total")
+                self.metrics.inc("mrg_cache_disk_hits_total")
+                return report
+
+        self.metrics.inc("mrg_cache_misses_total")
+        return None
+
+    def put(self, key, report):
+        self._remember(key, report)
+        if self.disk_dir:
+            eventlet.spawn_n(self._store_disk, key, report)
@@ -0,0 +1,91 @@
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def serving_cfg():
+    cfg = {
+        # how long the batcher keeps a window open after the first request
+        "batch_window_ms": float(os.environ.get("MRG_BATCH_WINDOW_MS", 20)),
+        "max_batch_size": int(os.environ.get("MRG_MAX_BATCH_SIZE", 8)),
+        # upper bound on the time a request may sit in the queue before its
+        # batch is flushed, regardless of the window
+        "max_queue_wait_ms": float(os.environ.get("MRG_MAX_QUEUE_WAIT_MS", 100)),
+        # native threads running inference off the eventlet hub
+        "pool_size": int(os.environ.get("MRG_POOL_SIZE", 1)),
+        # native threads for decoding, hashing and cache/archive disk I/O, kept
+        # apart from the inference threads
+        "io_threads": int(os.environ.get("MRG_IO_THREADS", 4)),
+        # requests allowed to wait for a batch before new ones are refused
+        "queue_depth": int(os.environ.get("MRG_QUEUE_DEPTH", 64)),
+        # requests a single client may have queued or in flight at once
+        "max_client_requests": int(os.environ.get("MRG_MAX_CLIENT_REQUESTS", 4)),
+        # how long a POST /mrg/batch image keeps retrying a full queue before
+        # its line reports the error instead
+        "batch_retry_s": float(os.environ.get("MRG_BATCH_RETRY_S", 300)),
+        # how often progress from a running inference is forwarded to clients
+        "progress_poll_ms": float(os.environ.get("MRG_PROGRESS_POLL_MS", 50)),
+        # minimum gap between two partial reports streamed for one request
+        "stream_interval_ms": float(os.environ.get("MRG_STREAM_INTERVAL_MS", 250)),
+        # intra-op threads per inference call, 0 keeps the torch default
+        "torch_threads": int(os.environ.get("MRG_TORCH_THREADS", 0)),
+        # models are loaded once in the gunicorn master and shared with workers
+        "preload": os.environ.get("MRG_PRELOAD", "0") == "1",
+        # keep a copy of every upload under assets/, written in the background
+        "archive_uploads": os.environ.get("MRG_ARCHIVE_UPLOADS", "1") == "1",
+        "assets_dir": os.environ.get(
+            "MRG_ASSETS_DIR", os.path.join(os.getcwd(), "assets")
+        ),
+        # retention budget of the archive, 0 disables either limit
+        "assets_max_mb": float(os.environ.get("MRG_ASSETS_MAX_MB", 10240)),
+        "assets_max_age_days": float(os.environ.get("MRG_ASSETS_MAX_AGE_DAYS", 30)),
+        # how often the archive is checked against its budget
+        "assets_sweep_s": float(os.environ.get("MRG_ASSETS_SWEEP_S", 600)),
+        # uploads waiting for the writer before new ones are dropped
+        "assets_queue": int(os.environ.get("MRG_ASSETS_QUEUE", 256)),
+        # pipeline-parallel mode: classifier and report model run side by side
+        # on their own threads; 0 threads means an even share of the cores,
+        # CPUs ("0-7,16-23") pin a branch, e.g. to one NUMA node
+        "parallel_branches": os.environ.get("MRG_PARALLEL_BRANCHES", "0") == "1",
+        "classifier_threads": int(os.environ.get("MRG_CLASSIFIER_THREADS", 0)),
+        "report_threads": int(os.environ.get("MRG_REPORT_THREADS", 0)),
+        "classifier_cpus": os.environ.get("MRG_CLASSIFIER_CPUS", ""),
+        "report_cpus": os.environ.get("MRG_REPORT_CPUS", ""),
+        # e.g. cuda:1 to keep the classifier off the report model's GPU
+        "classifier_device": os.environ.get("MRG_CLASSIFIER_DEVICE", "cpu"),
+        # preprocess each batch with torch ops on the classifier device rather
+        # than image by image with OpenCV; pays off on a GPU or many cores
+        "batched_preprocess": os.environ.get("MRG_BATCHED_PREPROCESS", "0") == "1",
+        # both models take the grey image once instead of three identical
+        # channels, with the replication folded into their first conv
+        "single_channel": os.environ.get("MRG_SINGLE_CHANNEL", "0") == "1",
+        # fold the frozen BatchNorms of both CNNs into the convs before them;
+        # the folded weights are new copies, not mapped from the checkpoint
+        "fold_bn": os.environ.get("MRG_FOLD_BN", "0") == "1",
+        # "onnx" runs both CNNs with ONNX Runtime's CPU provider, exported on
+        # first start into MRG_ONNX_DIR
+        "backend": os.environ.get("MRG_BACKEND", "torch"),
+        "onnx_dir": os.environ.get("MRG_ONNX_DIR", "./weights/onnx"),
+        # "512x384,384x512": (height x width) canvases besides the square the
+        # classifier may take an image at, whichever is nearest in aspect ratio
+        "aspect_buckets": [
+            tuple(int(side) for side in size.strip().split("x"))
+            for size in os.environ.get("MRG_ASPECT_BUCKETS", "").split(",")
+            if size.strip()
+        ],
+        # run synthetic batches of these sizes before reporting ready, empty
+        # means 1 and max_batch_size; MRG_WARMUP=0 skips warmup entirely
+        "warmup": os.environ.get("MRG_WARMUP", "1") == "1",
+        "warmup_batch_sizes": [
+            int(size)
+            for size in os.environ.get("MRG_WARMUP_BATCH_SIZES", "").split(",")
+            if size.strip()
+        ],
+        # finished reports kept in memory, 0 disables the memory tier
+        "cache_size": int(os.environ.get("MRG_CACHE_SIZE", 1024)),
+        # directory for the persistent cache tier, empty disables it
+        "cache_dir": os.environ.get("MRG_CACHE_DIR", ""),
+    }
+    return cfg
@@ -0,0 +1,84 @@
+from collections import deque
+
+import eventlet
+from eventlet import tpool
+from eventlet.semaphore import Semaphore
+
+from serving.native import NativeWorkers
+
+
+class InferenceExecutor:
+    """
+    Runs blocking model calls on eventlet's native OS thread pool so the
+    green-thread hub keeps answering pings, connects and other clients while
+    PyTorch is busy. Callers block only their own green thread.
+    """
+
+    def __init__(self, cfg, metrics):
+        self.pool_size = cfg["pool_size"]
+        self.progress_poll = cfg["progress_poll_ms"] / 1000.0
+        self.metrics = metrics
+        # must happen before the first tpool.execute() sets the pool up
+        tpool.set_num_threads(self.pool_size)
+        self._slots = Semaphore(self.pool_size)
+
+        self.metrics.set_gauge("mrg_inference_pool_size", self.pool_size)
+
+    def wait_available(self):
+        # block the calling green thread until a worker thread is free
+        self._slots.acquire()
+        self._slots.release()
+
+    def execute(self, fn, *args, on_progress=None, **kwargs):
+        """
+        Run `fn` on a worker thread. With `on_progress`, `fn` also gets a
+        `progress` callback; whatever it is called with on the worker thread is
+        replayed through `on_progress` on the calling green thread.
+        """
+        with self._slots:
+            if on_progress is None:
+                return tpool.execute(fn, *args, **kwargs)
+            return self._execute_with_progress(fn, args, kwargs, on_progress)
+
+    def _execute_with_progress(self, fn, args, kwargs, on_progress):
+        # the worker thread must never touch the hub, so progress events go
+        # through a deque (appends/pops are atomic) drained from this side
+        events = deque()
+
+        def drain():
+            while events:
+                on_progress(*events.popleft())
+
+        kwargs["progress"] = lambda *event: events.append(event)
+        worker = eventlet.spawn(tpool.execute, fn, *args, **kwargs)
+        while not worker.dead:
+            eventlet.sleep(self.progress_poll)
+            drain()
+        result = worker.wait()
+        drain()
+        return result
+
+
+class IOExecutor:
+    """
+    A few native threads of its own for the blocking work around inference:
+    decoding and hashing uploads, report cache and asset archive disk I/O.
+    tpool runs inference only, so none of this queues behind a running batch
+    and a cache hit is answered while the model is busy. Callers block only
+    their own green thread.
+    """
+
+    # a worker thread cannot wake the hub, the caller polls with backoff
+    POLL_MIN = 0.0005
+    POLL_MAX = 0.02
+
+    def __init__(self, cfg):
+        self._workers = NativeWorkers("mrg-io", max(1, cfg["io_threads"]))
+
+    def execute(self, fn, *args, **kwargs):
+        call = self._workers.submit(fn, *args, **kwargs)
+        delay = self.POLL_MIN
+        while not call.done.is_set():
+            eventlet.sleep(delay)
+            delay = min(delay * 2, self.POLL_MAX)
+        return call.wait()
@@ -0,0 +1,145 @@
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+from serving import native
+
+
+# upper bounds, in seconds, for latency style histograms
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS, max_samples=2048):
+        self.buckets = tuple(sorted(buckets))
+        self.bucket_counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=max_samples)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.samples.append(value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+                break
+
+    def quantiles(self, qs=(0.5, 0.95, 0.99)):
+        # exact over the most recent `max_samples` observations
+        samples = sorted(self.samples)
+        if not samples:
+            return {q: 0.0 for q in qs}
+        return {q: samples[min(int(q * len(samples)), len(samples) - 1)] for q in qs}
+
+    def snapshot(self):
+        # cumulative counts per upper bound, like a prometheus histogram
+        cumulative, buckets = 0, {}
+        for bound, n in zip(self.buckets, self.bucket_counts):
+            cumulative += n
+            buckets[str(bound)] = cumulative
+        buckets["+Inf"] = self.count
+        quantiles = self.quantiles()
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": quantiles[0.5],
+            "p95": quantiles[0.95],
+            "p99": quantiles[0.99],
+            "buckets": buckets,
+        }
+
+
+class Metrics:
+    def __init__(self):
+        # written from green threads and from native inference threads
+        self._lock = native.threading.Lock()
+        self.counters = defaultdict(float)
+        self.gauges = {}
+        self.histograms = defaultdict(Histogram)
+
+    def register_histogram(self, name, buckets):
+        # for histograms whose values are not latencies
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(buckets)
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name, value):
+        with self._lock:
+            self.histograms[name].observe(value)
+
+    @contextmanager
+    def time(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def stage_timer(self, stage):
+        # one histogram per pipeline stage, distinguished by a `stage` label
+        return self.time(f'mrg_stage_seconds{{stage="{stage}"}}')
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "histograms": {k: v.snapshot() for k, v in self.histograms.items()},
+            }
+
+    def prometheus(self):
+        """
+        Text exposition format. Names may carry labels, e.g.
+        'mrg_stage_seconds{stage="encoder"}'; p50/p95/p99 of every histogram
+        are exported as separate `<name>_p50` style gauges.
+        """
+        snapshot = self.snapshot()
+        lines, typed = [], set()
+
+        def sample(name, value, extra_label=None):
+            base, _, labels = name.partition("{")
+            labels = labels.rstrip("}")
+            if extra_label:
+                labels = f"{labels},{extra_label}" if labels else extra_label
+            lines.append(f"{base}{{{labels}}} {value}" if labels else f"{base} {value}")
+
+        def declare(name, kind):
+            base = name.partition("{")[0]
+            if base not in typed:
+                typed.add(base)
+                lines.append(f"# TYPE {base} {kind}")
+
+        for name, value in sorted(snapshot["counters"].items()):
+            declare(name, "counter")
+            sample(name, value)
+        for name, value in sorted(snapshot["gauges"].items()):
+            declare(name, "gauge")
+            sample(name, value)
+        for name, hist in sorted(snapshot["histograms"].items()):
+            base = name.partition("{")[0]
+            declare(name, "histogram")
+            for bound, count in hist["buckets"].items():
+                sample(name.replace(base, f"{base}_bucket", 1), count, f'le="{bound}"')
+            sample(name.replace(base, f"{base}_sum", 1), hist["sum"])
+            sample(name.replace(base, f"{base}_count", 1), hist["count"])
+        for q in ("p50", "p95", "p99"):
+            for name, hist in sorted(snapshot["histograms"].items()):
+                base = name.partition("{")[0]
+                quantile_name = name.replace(base, f"{base}_{q}", 1)
+                declare(quantile_name, "gauge")
+                sample(quantile_name, hist[q])
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
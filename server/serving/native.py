@@ -0,0 +1,67 @@
+import os
+
+from eventlet.patcher import original
+
+# real OS threads and primitives even where eventlet has monkey patched them:
+# model code and blocking I/O run on native threads, never on the hub
+threading = original("threading")
+queue = original("queue")
+
+
+class Call:
+    __slots__ = ("fn", "args", "kwargs", "done", "result", "error")
+
+    def __init__(self, fn, args, kwargs):
+        self.fn, self.args, self.kwargs = fn, args, kwargs
+        self.done = threading.Event()
+        self.result = self.error = None
+
+    def run(self):
+        try:
+            self.result = self.fn(*self.args, **self.kwargs)
+        except Exception as e:
+            self.error = e
+        self.done.set()
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class NativeWorkers:
+    """
+    `count` native threads running the calls submitted to them in order.
+    They are started on first use and again in every process that uses them,
+    threads do not survive a fork and models may be built in a preloading
+    master. `setup`, if given, runs first on each thread.
+    """
+
+    def __init__(self, name, count=1, setup=None):
+        self.name = name
+        self.count = count
+        self.setup = setup
+        self._calls = None
+        self._pid = None
+
+    def _start(self):
+        self._calls = queue.SimpleQueue()
+        self._pid = os.getpid()
+        for index in range(self.count):
+            name = self.name if self.count == 1 else f"{self.name}-{index}"
+            threading.Thread(target=self._run, name=name, daemon=True).start()
+
+    def _run(self):
+        if self.setup is not None:
+            self.setup()
+        while True:
+            self._calls.get().run()
+
+    def submit(self, fn, *args, **kwargs):
+        # returns the Call, whose wait() blocks until it ran
+        if self._pid != os.getpid():
+            self._start()
+        call = Call(fn, args, kwargs)
+        self._calls.put(call)
+        return call
@@ -0,0 +1,49 @@
+import json
+import os
+import sys
+
+import pytest
+import torch
+import torch.nn as nn
+from easydict import EasyDict as edict
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the server modules import each other from the server directory
+sys.path.insert(0, SERVER_DIR)
+
+
+@pytest.fixture
+def img_cfg():
+    # the classifier config the server runs with
+    with open(os.path.join(SERVER_DIR, "diagnosis_module/cxr/config/JF.json")) as f:
+        return edict(json.load(f))
+
+
+def randomize_bn(model):
+    # checkpoint-like BatchNorms: a fresh one is the identity in eval mode
+    generator = torch.Generator().manual_seed(0)
+    with torch.no_grad():
+        for module in model.modules():
+            if isinstance(module, nn.modules.batchnorm._BatchNorm):
+                module.running_mean.uniform_(-0.5, 0.5, generator=generator)
+                module.running_var.uniform_(0.5, 2.0, generator=generator)
+                module.weight.uniform_(0.5, 1.5, generator=generator)
+                module.bias.uniform_(-0.5, 0.5, generator=generator)
+    return model.eval()
+
+
+@pytest.fixture
+def classifier(img_cfg):
+    from diagnosis_module.cxr.models.classifier import Classifier
+
+    torch.manual_seed(0)
+    return randomize_bn(Classifier(img_cfg))
+
+
+@pytest.fixture
+def visual_extractor():
+    # resnet50: the same Bottleneck blocks as the production resnet101
+    from r2g.mgr_backbone.visual_extractor import VisualExtractor
+
+    torch.manual_seed(0)
+    return randomize_bn(VisualExtractor({"visual_extractor": "resnet50"}))
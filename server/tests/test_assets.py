@@ -0,0 +1,50 @@
+import os
+
+import eventlet
+
+from serving.assets import AssetStore
+from serving.executor import IOExecutor
+from serving.metrics import Metrics
+
+
+def store(tmp_path, **cfg):
+    cfg = {
+        "assets_dir": str(tmp_path),
+        "assets_max_mb": 0,
+        "assets_max_age_days": 0,
+        "assets_sweep_s": 600,
+        "assets_queue": 4,
+        "io_threads": 1,
+        **cfg,
+    }
+    return AssetStore(cfg, Metrics(), IOExecutor(cfg))
+
+
+def archived(tmp_path):
+    return [name for _, _, names in os.walk(tmp_path) for name in names]
+
+
+def test_put_writes_each_upload_once(tmp_path):
+    assets = store(tmp_path)
+    for data in (b"a" * 10, b"a" * 10, b"b" * 10):
+        assets.put(data)
+    # written in the background, the duplicate is only refreshed
+    for _ in range(200):
+        if len(archived(tmp_path)) == 2 and assets._queue.empty():
+            break
+        eventlet.sleep(0.01)
+    assert len(archived(tmp_path)) == 2
+
+
+def test_sweep_evicts_oldest_over_budget(tmp_path):
+    assets = store(tmp_path, assets_max_mb=1.5 / 1024)
+    for index, data in enumerate((b"a" * 1024, b"b" * 1024)):
+        path = assets._path(str(index) * 64, "png")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        os.utime(path, (index, index))
+
+    total, evicted = assets.io.execute(assets._sweep)
+    assert (total, evicted) == (1024, 1)
+    assert archived(tmp_path) == ["1" * 64 + ".png"]
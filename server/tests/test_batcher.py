@@ -0,0 +1,58 @@
+import pytest
+
+from serving.batcher import MicroBatcher
+from serving.executor import InferenceExecutor
+from serving.metrics import Metrics
+
+CFG = {
+    "pool_size": 1,
+    "progress_poll_ms": 10,
+    "batch_window_ms": 50,
+    "max_batch_size": 4,
+    "max_queue_wait_ms": 100,
+    "queue_depth": 16,
+    "max_client_requests": 4,
+}
+
+
+def infer(items):
+    # fails the whole batch if any item is bad, like get_cxr_imgs does
+    if "bad" in items:
+        raise ValueError("cannot preprocess")
+    return [item.upper() for item in items]
+
+
+def test_bad_item_fails_only_its_request():
+    metrics = Metrics()
+    batcher = MicroBatcher(infer, InferenceExecutor(CFG, metrics), CFG, metrics)
+    events = [
+        batcher.submit(item, client)
+        for item, client in (("a", "x"), ("bad", "y"), ("b", "z"))
+    ]
+    assert events[0].wait() == "A"
+    with pytest.raises(ValueError):
+        events[1].wait()
+    assert events[2].wait() == "B"
+    snapshot = metrics.snapshot()
+    assert snapshot["counters"]["mrg_batches_total"] == 1
+    assert snapshot["counters"]["mrg_batch_retries_total"] == 1
+
+    # every request left the queue, the clients may queue again
+    assert batcher.submit("c", "y").wait() == "C"
+
+
+def test_in_flight_counts_requests():
+    metrics = Metrics()
+    seen = []
+
+    def infer_and_record(items):
+        seen.append(metrics.snapshot()["gauges"]["mrg_inference_in_flight"])
+        return items
+
+    batcher = MicroBatcher(
+        infer_and_record, InferenceExecutor(CFG, metrics), CFG, metrics
+    )
+    events = [batcher.submit(item, client) for item, client in (("a", "x"), ("b", "y"))]
+    assert [event.wait() for event in events] == ["a", "b"]
+    assert seen == [2]
+    assert metrics.snapshot()["gauges"]["mrg_inference_in_flight"] == 0
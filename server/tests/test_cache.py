@@ -0,0 +1,16 @@
+from serving.cache import ReportCache
+from serving.executor import IOExecutor
+from serving.metrics import Metrics
+
+
+def test_disk_hit_without_memory_tier(tmp_path):
+    cfg = {"cache_size": 0, "cache_dir": str(tmp_path), "io_threads": 1}
+    metrics = Metrics()
+    cache = ReportCache(cfg, metrics, IOExecutor(cfg))
+    cache._write_disk("ab" * 32, "report")
+
+    assert cache.get("ab" * 32) == "report"
+    counters = metrics.snapshot()["counters"]
+    assert counters["mrg_cache_disk_hits_total"] == 1
+    assert "mrg_cache_evictions_total" not in counters
+    assert not cache._lru
@@ -0,0 +1,21 @@
+import torch
+
+from bench.common import relative_error
+
+
+def test_predict_matches_forward(classifier):
+    x = torch.randn(2, 3, 256, 256)
+    with torch.no_grad():
+        expected = torch.cat(classifier(x)[0], dim=1)
+        uncached = classifier.predict(x)
+        classifier.cache_heads()
+        cached = classifier.predict(x)
+    assert relative_error(expected, uncached) < 1e-4
+    assert torch.equal(cached, uncached)
+
+
+def test_cached_heads_stay_out_of_state_dict(classifier):
+    keys = set(classifier.state_dict())
+    classifier.cache_heads()
+    assert set(classifier.state_dict()) == keys
+    assert classifier.head_weight.shape[0] == len(classifier.cfg.num_classes)
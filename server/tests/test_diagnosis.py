@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from diagnosis_module.cxr.diagnosis import get_cxr_img, get_cxr_img_from_array
+
+
+def portrait():
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, (1000, 700), dtype=np.uint8)
+
+
+def test_single_image_helper_square(img_cfg):
+    img1, img2 = get_cxr_img_from_array(portrait(), img_cfg)
+    assert tuple(img1.shape) == (1, 3, 224, 224)
+    assert tuple(img2.shape) == (1, 3, 512, 512)
+
+
+@pytest.mark.parametrize(
+    "array, shape",
+    [(portrait(), (512, 384)), (portrait().T.copy(), (384, 512))],
+)
+def test_single_image_helper_aspect_buckets(img_cfg, array, shape):
+    img_cfg.aspect_buckets = [[512, 384], [384, 512]]
+    img1, img2 = get_cxr_img(array, img_cfg)
+    assert tuple(img1.shape) == (1, 3, 224, 224)
+    assert tuple(img2.shape) == (1, 3) + shape
+    # copies, not views of the reusable buffers
+    before = img2.clone()
+    get_cxr_img(np.zeros_like(array), img_cfg)
+    assert (img2 == before).all()
+    assert get_cxr_img(array, img_cfg, idx=2).shape == img2.shape
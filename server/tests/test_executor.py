@@ -0,0 +1,42 @@
+import eventlet
+import pytest
+from eventlet.patcher import original
+
+from serving.executor import InferenceExecutor, IOExecutor
+from serving.metrics import Metrics
+
+_threading = original("threading")
+
+CFG = {"pool_size": 1, "progress_poll_ms": 10, "io_threads": 2}
+
+
+def test_io_does_not_queue_behind_inference():
+    executor = InferenceExecutor(CFG, Metrics())
+    io = IOExecutor(CFG)
+    release = _threading.Event()
+    inference = eventlet.spawn(executor.execute, release.wait, 10)
+    eventlet.sleep(0.05)
+
+    # the only inference thread is busy, I/O still completes
+    assert io.execute(sum, [1, 2, 3]) == 6
+    assert not inference.dead
+
+    release.set()
+    assert inference.wait() is True
+
+
+def test_io_reraises_errors():
+    io = IOExecutor(CFG)
+    with pytest.raises(ValueError):
+        io.execute(int, "not a number")
+
+
+def test_native_workers_run_setup_then_calls():
+    from serving.native import NativeWorkers
+
+    local = _threading.local()
+    workers = NativeWorkers("test", setup=lambda: setattr(local, "ready", True))
+    calls = [workers.submit(getattr, local, "ready"), workers.submit(int, "x")]
+    assert calls[0].wait() is True
+    with pytest.raises(ValueError):
+        calls[1].wait()
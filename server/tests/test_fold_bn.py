@@ -0,0 +1,37 @@
+import torch
+
+from bench.common import relative_error
+from optimize.fold_bn import fold_bn_classifier, fold_bn_visual_extractor
+from optimize.single_channel import single_channel_classifier
+
+
+def test_fold_bn_classifier(classifier):
+    x = torch.randn(2, 3, 256, 192)
+    with torch.no_grad():
+        expected = classifier.predict(x)
+        folded, _ = fold_bn_classifier(classifier)
+        actual = classifier.predict(x)
+    assert folded > 0
+    assert relative_error(expected, actual) < 1e-4
+
+
+def test_fold_bn_single_channel_classifier(classifier):
+    # the grey stem is folded first in MRG, then its BatchNorm
+    x = torch.randn(2, 1, 256, 256)
+    with torch.no_grad():
+        expected = classifier.predict(x.expand(-1, 3, -1, -1))
+        single_channel_classifier(classifier)
+        fold_bn_classifier(classifier)
+        actual = classifier.predict(x)
+    assert relative_error(expected, actual) < 1e-4
+
+
+def test_fold_bn_visual_extractor(visual_extractor):
+    x = torch.randn(2, 3, 224, 224)
+    with torch.no_grad():
+        expected = visual_extractor(x)
+        folded, _ = fold_bn_visual_extractor(visual_extractor)
+        actual = visual_extractor(x)
+    assert folded > 0
+    for a, b in zip(expected, actual):
+        assert relative_error(a, b) < 1e-4
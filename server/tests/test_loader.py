@@ -0,0 +1,53 @@
+import json
+
+import pytest
+import torch
+from safetensors.torch import save_file
+
+from model_io.loader import ALIASES_KEY, load_safetensors, upcast
+
+
+def test_upcast_keeps_aliases_shared():
+    weight = torch.randn(4, 4, dtype=torch.float16)
+    state_dict = {
+        "embed.weight": weight,
+        "logit.weight": weight,
+        "tied_view.weight": weight.view(4, 4),
+        "bias": torch.randn(4),
+        "steps": torch.tensor(3),
+    }
+    result = upcast(state_dict)
+    assert result["embed.weight"].dtype == torch.float32
+    assert result["logit.weight"] is result["embed.weight"]
+    assert result["tied_view.weight"] is result["embed.weight"]
+    # float32 and integer tensors are passed through untouched
+    assert result["bias"] is state_dict["bias"]
+    assert result["steps"] is state_dict["steps"]
+
+
+def test_upcast_safetensors_aliases(tmp_path):
+    path = str(tmp_path / "tied.safetensors")
+    weight = torch.randn(4, 4, dtype=torch.float16)
+    save_file(
+        {"embed.weight": weight},
+        path,
+        metadata={ALIASES_KEY: json.dumps({"logit.weight": "embed.weight"})},
+    )
+    result = upcast(load_safetensors(path))
+    assert result["logit.weight"] is result["embed.weight"]
+    assert torch.equal(result["embed.weight"], weight.float())
+
+
+@pytest.mark.parametrize("dtype", ["fp32", "bf16", "fp16"])
+def test_convert_keeps_aliases(tmp_path, dtype):
+    from model_io.convert import convert
+
+    # a module registered twice, like the report model's memory module
+    shared = torch.randn(4, 4)
+    src = str(tmp_path / "model.pth")
+    torch.save({"state_dict": {"cmn.weight": shared, "model.cmn.weight": shared}}, src)
+
+    state_dict = load_safetensors(convert(src, dtype=dtype))
+    assert (
+        state_dict["cmn.weight"].data_ptr() == state_dict["model.cmn.weight"].data_ptr()
+    )
@@ -0,0 +1,51 @@
+import os
+
+import pytest
+import torch
+
+from bench.common import relative_error
+from model_io.onnx_export import export_classifier, export_visual_extractor
+from r2g.mrg_main import prune_onnx
+
+# the onnx backend is optional
+pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+
+
+def test_classifier_at_bucket_shapes(classifier, tmp_path):
+    from model_io.onnx_runtime import OrtClassifier
+
+    session = OrtClassifier(
+        export_classifier(classifier, str(tmp_path / "classifier.onnx"))
+    )
+    # one dynamic graph for the square and the aspect buckets
+    for shape in ((1, 3, 256, 256), (3, 3, 512, 384)):
+        x = torch.randn(shape)
+        with torch.no_grad():
+            expected = classifier.predict(x)
+        assert relative_error(expected, session.predict(x)) < 1e-4, shape
+
+
+def test_visual_extractor_trunk(visual_extractor, tmp_path):
+    from model_io.onnx_runtime import OrtModule
+
+    trunk = OrtModule(
+        export_visual_extractor(visual_extractor, str(tmp_path / "trunk.onnx"))
+    )
+    x = torch.randn(2, 3, 224, 224)
+    with torch.no_grad():
+        expected = visual_extractor.model(x)
+    assert relative_error(expected, trunk(x)) < 1e-4
+
+
+def test_prune_onnx_keeps_current_graphs(tmp_path):
+    names = [
+        "classifier-old.onnx",
+        "classifier-new.onnx",
+        "visual_extractor-old.onnx",
+        "classifier-new.onnx.123.tmp",
+    ]
+    for name in names:
+        (tmp_path / name).write_bytes(b"")
+    prune_onnx(str(tmp_path / "classifier-new.onnx"))
+    assert sorted(os.listdir(tmp_path)) == sorted(names[1:])
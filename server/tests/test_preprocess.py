@@ -0,0 +1,66 @@
+import cv2
+import numpy as np
+import pytest
+import torch
+from easydict import EasyDict as edict
+from PIL import Image
+
+from diagnosis_module.cxr.diagnosis import get_cxr_imgs
+from diagnosis_module.cxr.preprocess import (
+    GAUSSIAN_KERNELS,
+    REPORT_STD,
+    batch_tensors,
+    equalize_hist,
+    gaussian_blur,
+    preprocessor,
+)
+
+
+def random_imgs(sizes_and_modes):
+    rng = np.random.default_rng(0)
+    imgs = []
+    for (h, w), mode in sizes_and_modes:
+        shape = (h, w) if mode == "L" else (h, w, 3)
+        imgs.append(Image.fromarray(rng.integers(0, 256, shape, dtype=np.uint8)))
+    return imgs
+
+
+@pytest.mark.parametrize("shape", [(37, 53), (300, 200)])
+def test_equalize_and_blur_match_opencv(shape):
+    rng = np.random.default_rng(0)
+    images = rng.integers(30, 200, (3,) + shape, dtype=np.uint8)
+    images[2] = 77  # constant images too
+    equalized = equalize_hist(torch.from_numpy(images)).numpy()
+    for out, image in zip(equalized, images):
+        np.testing.assert_array_equal(out, cv2.equalizeHist(image))
+    for k in GAUSSIAN_KERNELS:
+        blurred = gaussian_blur(torch.from_numpy(images), k).numpy()
+        for out, image in zip(blurred, images):
+            np.testing.assert_array_equal(out, cv2.GaussianBlur(image, (k, k), 0))
+
+
+@pytest.mark.parametrize("channels", [3, 1])
+def test_batched_matches_opencv_path(img_cfg, channels):
+    # mixed sizes and modes, so several shape groups in one batch
+    imgs = random_imgs(
+        [((700, 580), "L"), ((700, 580), "L"), ((300, 460), "RGB"), ((256, 256), "L")]
+    )
+    expected = [t.clone() for t in get_cxr_imgs(imgs, img_cfg, channels=channels)]
+    actual = batch_tensors(imgs, img_cfg, channels=channels)
+
+    # the resizes may round a pixel to the neighbouring grey level
+    tolerances = (1 / 255 / min(REPORT_STD), 1 / img_cfg.pixel_std)
+    for a, b, tolerance in zip(expected, actual, tolerances):
+        assert a.shape == b.shape
+        assert (a - b).abs().max().item() <= tolerance + 1e-6
+
+
+def test_preprocessor_follows_cfg_changes(img_cfg):
+    square = preprocessor(img_cfg)
+    # an equal cfg shares it, the same cfg given buckets later does not
+    assert preprocessor(edict(img_cfg)) is square
+    img_cfg.aspect_buckets = [[512, 384]]
+    bucketed = preprocessor(img_cfg)
+    assert bucketed is not square
+    assert bucketed.buckets == [(512, 512), (512, 384)]
+    assert square.buckets == [(512, 512)]
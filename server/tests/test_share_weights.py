@@ -0,0 +1,23 @@
+import torch
+import torch.nn as nn
+from safetensors.torch import save_file
+
+from model_io.loader import load_safetensors
+from r2g.mrg_main import share_weights
+
+
+def test_share_weights_leaves_mapped_checkpoint_in_place(tmp_path):
+    path = str(tmp_path / "linear.safetensors")
+    save_file({"weight": torch.randn(8, 4), "bias": torch.randn(8)}, path)
+    model = nn.Sequential(nn.Linear(4, 8), nn.BatchNorm1d(8))
+    model[0].load_state_dict(load_safetensors(path), assign=True)
+    mapped = model[0].weight.untyped_storage().data_ptr()
+
+    share_weights(model)
+
+    # the checkpoint views stay in the page cache, the rest moves to shm
+    assert model[0].weight.untyped_storage().data_ptr() == mapped
+    assert not model[0].weight.is_shared()
+    assert model[1].weight.is_shared()
+    assert model[1].running_mean.is_shared()
+    assert not model[0].weight.requires_grad
@@ -0,0 +1,46 @@
+import numpy as np
+import torch
+from PIL import Image
+
+from bench.common import relative_error
+from diagnosis_module.cxr.preprocess import REPORT_MEAN, REPORT_STD, report_image
+from optimize.single_channel import (
+    single_channel_classifier,
+    single_channel_visual_extractor,
+)
+
+
+def test_classifier_single_channel_matches_rgb(classifier):
+    # the classifier takes the normalised grey image in all three channels
+    x = torch.randn(2, 1, 256, 192)
+    with torch.no_grad():
+        expected = classifier.predict(x.expand(-1, 3, -1, -1))
+        single_channel_classifier(classifier)
+        actual = classifier.predict(x)
+    assert relative_error(expected, actual) < 1e-4
+
+
+def test_visual_extractor_single_channel_matches_rgb(visual_extractor):
+    # the report model normalises each channel of the ToTensor'd grey image
+    x = torch.rand(2, 1, 224, 224)
+    mean = torch.tensor(REPORT_MEAN)[:, None, None]
+    std = torch.tensor(REPORT_STD)[:, None, None]
+    with torch.no_grad():
+        expected = visual_extractor((x - mean) / std)
+        single_channel_visual_extractor(visual_extractor, REPORT_MEAN, REPORT_STD)
+        actual = visual_extractor(x)
+    for a, b in zip(expected, actual):
+        assert relative_error(a, b) < 1e-4
+
+
+def test_report_image_single_channel_is_luminance():
+    rng = np.random.default_rng(0)
+    grey = rng.integers(0, 256, (32, 24), dtype=np.uint8)
+    # a grey image stored as RGB comes back unchanged
+    rgb = Image.fromarray(np.repeat(grey[..., None], 3, axis=2))
+    np.testing.assert_array_equal(np.asarray(report_image(rgb, channels=1)), grey)
+    colour = Image.fromarray(rng.integers(0, 256, (32, 24, 3), dtype=np.uint8))
+    np.testing.assert_array_equal(
+        np.asarray(report_image(colour, channels=1)), np.asarray(colour.convert("L"))
+    )
+    assert report_image(colour, channels=3) is colour
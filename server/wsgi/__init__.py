@@ -1,19 +1,80 @@
 import base64
 import json
 import os
+import shutil
+import tempfile
+import time
+from functools import partial
+
+import psutil
 
 import torch
 from dotenv import load_dotenv
-from flask import Flask, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
+import eventlet
+from eventlet import GreenPool
+from eventlet.queue import Queue
 from flask_socketio import SocketIO, emit
 
+from diagnosis_module.cxr.diagnosis import decode_cxr_img
+from r2g.branches import Branch, parse_cpus
 from r2g.mrg_main import MRG
+from serving.admission import Rejected
+from serving.assets import AssetStore
+from serving.batcher import MicroBatcher
+from serving.cache import ReportCache, image_key
+from serving.config import serving_cfg
+from serving.executor import InferenceExecutor, IOExecutor
+from serving.metrics import metrics
 
 load_dotenv()
-CURRENT_DIR = os.getcwd()
+IMAGE_FORMATS = ("png", "jpeg")
+
+SERVING_CFG = serving_cfg()
+if SERVING_CFG["torch_threads"] > 0:
+    torch.set_num_threads(SERVING_CFG["torch_threads"])
 
-init_MRG = MRG()
+branches = None
+if SERVING_CFG["parallel_branches"]:
+    branches = (
+        Branch(
+            "classifier",
+            SERVING_CFG["classifier_threads"],
+            parse_cpus(SERVING_CFG["classifier_cpus"]),
+        ),
+        Branch(
+            "report",
+            SERVING_CFG["report_threads"],
+            parse_cpus(SERVING_CFG["report_cpus"]),
+        ),
+    )
+init_MRG = MRG(
+    share_memory=SERVING_CFG["preload"],
+    branches=branches,
+    classifier_device=SERVING_CFG["classifier_device"],
+    batched_preprocess=SERVING_CFG["batched_preprocess"],
+    single_channel=SERVING_CFG["single_channel"],
+    aspect_buckets=SERVING_CFG["aspect_buckets"],
+    fold_bn=SERVING_CFG["fold_bn"],
+    backend=SERVING_CFG["backend"],
+    onnx_dir=SERVING_CFG["onnx_dir"],
+)
+executor = InferenceExecutor(SERVING_CFG, metrics)
+io_executor = IOExecutor(SERVING_CFG)
+batcher = MicroBatcher(
+    partial(init_MRG.get_reports, timer=metrics.stage_timer),
+    executor,
+    SERVING_CFG,
+    metrics,
+)
+report_cache = ReportCache(SERVING_CFG, metrics, io_executor)
+PROCESS = psutil.Process()
+asset_store = AssetStore(SERVING_CFG, metrics, io_executor)
+MRG_FINGERPRINT = init_MRG.fingerprint()
+# flipped once warmup is done, until then the worker reports not ready
+SERVING_STATE = {"ready": False, "warmup": None}
+metrics.set_gauge("mrg_ready", 0)
 
 app = Flask(__name__)
 CORS(app)
@@ -27,40 +88,297 @@ socketio = SocketIO(
 
 device = "cuda" if torch.cuda.is_available() else "cpu"
 
+
+def warmup():
+    if SERVING_CFG["warmup"]:
+        batch_sizes = SERVING_CFG["warmup_batch_sizes"] or sorted(
+            {1, SERVING_CFG["max_batch_size"]}
+        )
+        try:
+            seconds = executor.execute(init_MRG.warmup, batch_sizes)
+        except Exception as e:
+            # a model that cannot run a synthetic batch cannot serve either
+            print(f"Error in mrg warmup: {e}")
+            return
+        metrics.set_gauge("mrg_warmup_seconds", seconds)
+        print(f"mrg warmed up with batch sizes {batch_sizes} in {seconds:.1f}s")
+    SERVING_STATE["ready"] = True
+    metrics.set_gauge("mrg_ready", 1)
+
+
+def start_serving():
+    # called once the serving process is up (gunicorn post_worker_init or
+    # __main__), so warmup runs on its hub and in its own native threads
+    if SERVING_STATE["warmup"] is None:
+        SERVING_STATE["warmup"] = eventlet.spawn(warmup)
+
+
 @socketio.on("connect")
 def connected():
     print("client connected")
-    emit("connected", {"data": f"id: {request.sid} is connected"})
+    emit(
+        "connected",
+        {
+            "data": f"id: {request.sid} is connected",
+            "ready": SERVING_STATE["ready"],
+        },
+    )
+
+
+def decode_and_key(img_bytes, size=None):
+    img = decode_cxr_img(img_bytes)
+    if size is not None and img.size != size:
+        # a truncated or mixed-up upload, not the image the header describes
+        raise ValueError("image is {}x{}, header says {}x{}".format(*img.size, *size))
+    return img, image_key(img, MRG_FINGERPRINT)
+
+
+def stream_progress(sid, unique_uuid):
+    # forwards model progress for one request while it is still running: the
+    # disease grading as soon as the classifier is done, then partial reports
+    interval = SERVING_CFG["stream_interval_ms"] / 1000.0
+    last_partial = {"at": 0.0, "text": None}
+
+    def on_progress(kind, text):
+        if kind == "grading":
+            socketio.emit(
+                "mrg_grading", {"unique_uuid": unique_uuid, "grading": text}, to=sid
+            )
+        elif kind == "partial":
+            now = time.monotonic()
+            if text == last_partial["text"] or now - last_partial["at"] < interval:
+                return
+            last_partial["at"], last_partial["text"] = now, text
+            socketio.emit(
+                "mrg_partial",
+                {"unique_uuid": unique_uuid, "partial_report": text},
+                to=sid,
+            )
+
+    return on_progress
+
+
+def generate_report(img_bytes, client, img_format="png", on_progress=None, size=None):
+    """
+    Shared by every transport: archive, cache lookup, then the batched model
+    path on behalf of `client`. Raises Rejected when admission control refuses
+    the request, and whatever decoding (or checking against the (width,
+    height) `size` the client sent) or the model raises.
+    """
+    if SERVING_CFG["archive_uploads"]:
+        asset_store.put(img_bytes, img_format)
+
+    # decode and hash off the hub (and off the inference threads), the cache
+    # is keyed on the decoded pixels
+    with metrics.stage_timer("decode"):
+        img, cache_key = io_executor.execute(decode_and_key, img_bytes, size)
+    report_result = report_cache.get(cache_key)
+
+    if report_result is None:
+        # pass to mrg pipeline, batched with whatever else is in flight. The
+        # model runs on a native thread, this green thread only waits for it.
+        pending = batcher.submit(img, client, on_progress=on_progress)
+        report_result = str(pending.wait())
+        report_cache.put(cache_key, report_result)
+    return report_result
+
+
+def run_mrg(unique_uuid, img_bytes, img_format="png", size=None):
+    try:
+        report_result = generate_report(
+            img_bytes,
+            request.sid,
+            img_format,
+            on_progress=stream_progress(request.sid, unique_uuid),
+            size=size,
+        )
+    except Rejected as e:
+        # queue full, too many requests from this client or cancelled
+        emit(
+            "mrg_busy",
+            {"unique_uuid": unique_uuid, "reason": e.reason},
+            to=request.sid,
+        )
+        return
+    except Exception as e:
+        # an undecodable upload or a failed model run, the client is told
+        # rather than left waiting for a result
+        print(f"Error in mrg: {e}")
+        emit(
+            "mrg_error",
+            {"unique_uuid": unique_uuid, "error": str(e)},
+            to=request.sid,
+        )
+        return
+
+    # send response back
+    emit(
+        "mrg_result",
+        {"mrg_result": report_result, "unique_uuid": unique_uuid},
+        to=request.sid,
+    )
 
 
 # @app.route("/mrg", methods=["POST"])
 @socketio.on("mrg")
 def mrg(data):
-    # Decode the base64 string
-    decoded_data = base64.b64decode(data["encoded_img"])
+    # legacy protocol: the image arrives base64 encoded inside the json payload
+    with metrics.stage_timer("base64_decode"):
+        decoded_data = base64.b64decode(data["encoded_img"])
+    run_mrg(data["unique_uuid"], decoded_data)
 
-    assets_dir = f"{CURRENT_DIR}/assets/{data['unique_uuid']}"
-    os.makedirs(assets_dir, exist_ok=True)
 
-    # Save the file
-    img_file_path = f"{assets_dir}/{data['unique_uuid']}.png"
-    with open(img_file_path, "wb") as f:
-        f.write(decoded_data)
+def valid_v2_header(meta):
+    # unique_uuid, a known format and positive integer dimensions
+    if not isinstance(meta, dict) or not meta.get("unique_uuid"):
+        return False
+    if meta.get("format") not in IMAGE_FORMATS:
+        return False
+    try:
+        return int(meta.get("width", 0)) > 0 and int(meta.get("height", 0)) > 0
+    except (ValueError, TypeError):
+        return False
 
-    # pass to mrg pipeline
-    report_result = init_MRG.get_report(img_file_path)
-    report_result = str(report_result)
-    # report_file_path = f"{assets_dir}/{data['unique_uuid']}.txt"
-    # with open(report_file_path, "wb") as f:
-    #     f.write(report_result)
 
-    # send response back
-    emit("mrg_result", {"mrg_result": report_result})
+@socketio.on("mrg_v2")
+def mrg_v2(meta, img):
+    # protocol v2: a small metadata header plus the image as a binary attachment
+    if not isinstance(img, bytes) or not valid_v2_header(meta):
+        unique_uuid = meta.get("unique_uuid") if isinstance(meta, dict) else None
+        emit(
+            "mrg_error",
+            {"unique_uuid": unique_uuid, "error": "invalid image payload"},
+            to=request.sid,
+        )
+        return
+    run_mrg(
+        meta["unique_uuid"],
+        img,
+        meta["format"],
+        size=(int(meta["width"]), int(meta["height"])),
+    )
+
+
+def spool_uploads(files):
+    # every upload to a file of its own, so a back-fill of thousands of studies
+    # is never held in worker memory; each is read when it is scheduled
+    spool_dir = tempfile.mkdtemp(prefix="mrg-batch-")
+    uploads = []
+    for index, f in enumerate(files):
+        path = os.path.join(spool_dir, str(index))
+        f.save(path)
+        uploads.append((f.filename, path))
+    return spool_dir, uploads
+
+
+def read_upload(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def batch_report_line(client, index, filename, path):
+    img_format = os.path.splitext(filename or "")[1].lstrip(".").lower()
+    img_format = "jpeg" if img_format == "jpg" else img_format
+    line = {"index": index, "filename": filename}
+    # a back-fill should wait for room rather than fail, but not forever
+    deadline = time.monotonic() + SERVING_CFG["batch_retry_s"]
+    try:
+        img_bytes = io_executor.execute(read_upload, path)
+    except OSError as e:
+        line["error"] = str(e)
+        return json.dumps(line) + "\n"
+    while True:
+        try:
+            line["mrg_result"] = generate_report(
+                img_bytes,
+                client,
+                img_format if img_format in IMAGE_FORMATS else "png",
+            )
+            break
+        except Rejected as e:
+            if e.reason == "cancelled" or time.monotonic() >= deadline:
+                line["error"] = e.reason
+                break
+            # back off until the queue has drained a little
+            eventlet.sleep(SERVING_CFG["max_queue_wait_ms"] / 1000.0)
+        except Exception as e:
+            line["error"] = str(e)
+            break
+    return json.dumps(line) + "\n"
+
+
+@app.route("/mrg/batch", methods=["POST"])
+def mrg_batch():
+    """
+    Bulk endpoint: every file of a multipart POST goes through the batched
+    model path and one NDJSON line per image is streamed back as soon as that
+    image is done, so lines arrive in completion order, not upload order.
+    """
+    files = request.files.getlist("images")
+    if not files:
+        return jsonify({"error": "no images, send them as multipart 'images'"}), 400
+    # spooled while the request is still open, the stream outlives the form
+    spool_dir, uploads = io_executor.execute(spool_uploads, files)
+
+    # all images of one HTTP client share its admission share, so at most that
+    # many are handed to the batcher at once
+    client = f"http:{request.remote_addr}"
+    pool = GreenPool(SERVING_CFG["max_client_requests"])
+    lines = Queue()
+
+    def report(index, filename, path):
+        lines.put(batch_report_line(client, index, filename, path))
+
+    def feed():
+        # blocks whenever the pool is full, i.e. the client's share is in use
+        for index, (filename, path) in enumerate(uploads):
+            pool.spawn(report, index, filename, path)
+
+    @stream_with_context
+    def stream():
+        feeder = eventlet.spawn(feed)
+        try:
+            for _ in uploads:
+                yield lines.get()
+        finally:
+            # the client hung up, stop feeding its images to the model
+            feeder.kill()
+            for gt in list(pool.coroutines_running):
+                gt.kill()
+            io_executor.execute(shutil.rmtree, spool_dir, True)
+
+    return Response(stream(), mimetype="application/x-ndjson")
+
+
+def update_process_metrics():
+    metrics.set_gauge("process_resident_memory_bytes", PROCESS.memory_info().rss)
+
+
+@app.route("/readyz")
+def readyz():
+    # for the load balancer: no traffic until the models are warm
+    if SERVING_STATE["ready"]:
+        return jsonify({"status": "ready"})
+    return jsonify({"status": "warming up"}), 503
+
+
+@app.route("/metrics")
+def metrics_prometheus():
+    update_process_metrics()
+    return Response(metrics.prometheus(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/metrics.json")
+def metrics_snapshot():
+    update_process_metrics()
+    return jsonify(metrics.snapshot())
 
 
 @socketio.on("disconnect")
 def disconnected():
     """event listener when client disconnects to the server"""
+    # nobody is left to receive the results of what it still has queued
+    batcher.cancel(request.sid)
     emit("disconnect", f"user {request.sid} disconnected", broadcast=True)
     print("user disconnected")
 
@@ -72,6 +390,7 @@ def error_handler(e):
 
 if __name__ == "__main__":
     try:
+        start_serving()
         # app.run(host="0.0.0.0", port=int(os.environ["PORT"]))
         socketio.run(
             app,